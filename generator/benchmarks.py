@@ -0,0 +1,495 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import timeit
+from collections import defaultdict
+
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from .perashki_generator import MarkovChainsGenerator, DEFAULT_DUMP_FILENAME, ENGINES, \
+    generate_many, get_corpus_files, train_generator
+from .reference import linear_sample, beam_yo_accents, trie_yo_accents, per_word_accent, \
+    train_accent_classifiers
+from .ngram_counting import count_fragments
+from .phonetic_index import PhoneticIndex
+from .sampling import SamplingTable
+from .ngram_store import CompactNgramStore
+from perashki.corpus import read_fragments, read_lines
+from phonetics.accent_dict import AccentDict
+from phonetics.accent_store import build_accent_store
+from phonetics.phonetics import Phonetics, get_default_accents_dict, load_accents_dict
+from django.conf import settings
+
+
+def percentiles(values, points=(50, 95, 99)):
+    values = sorted(values)
+    result = {'p{}'.format(point): values[min(len(values) - 1, len(values) * point // 100)] for point in points}
+    result['max'] = values[-1]
+    result['mean'] = sum(values) / len(values)
+    return result
+
+
+def load_generator(dump_filename=DEFAULT_DUMP_FILENAME, depth=2):
+    generator = MarkovChainsGenerator(depth)
+    generator.load_dumped(dump_filename)
+    return generator
+
+
+def bench_sampler(generator, draws=20000, chains_number=5):
+    """
+    Compares the linear sampler with SamplingTable on the empty chain
+    and on the chains with the highest fanout.
+    """
+    frequencies = generator.get_frequencies()
+    chains = sorted(frequencies, key=lambda chain: -len(frequencies[chain]))
+    chains = [tuple()] + [chain for chain in chains if chain][:chains_number - 1]
+
+    results = []
+    for chain in chains:
+        token_counter = frequencies[chain]
+        table = SamplingTable(token_counter)
+        linear_time = timeit.timeit(lambda: linear_sample(token_counter), number=draws)
+        table_time = timeit.timeit(table.sample, number=draws)
+        results.append({
+            'chain': ' '.join(chain),
+            'fanout': len(token_counter),
+            'linear_us_per_draw': linear_time / draws * 1e6,
+            'table_us_per_draw': table_time / draws * 1e6,
+            'speedup': linear_time / table_time,
+        })
+    return results
+
+
+def bench_memory(generator, loads=3):
+    """
+    Memory footprint and unpickling time of the dict and the compact representations.
+    """
+    report = generator.memory_report()
+    frequencies = generator.get_frequencies()
+    for name, model in (('dict', frequencies),
+                        ('compact', CompactNgramStore.from_frequencies(frequencies, generator.depth))):
+        dumped = pickle.dumps(model)
+        report[name + '_pickle_bytes'] = len(dumped)
+        report[name + '_load_seconds'] = timeit.timeit(lambda: pickle.loads(dumped), number=loads) / loads
+    return report
+
+
+def bench_draws(generator, lines=200):
+    """
+    Random draws and time per generated line with rejection sampling
+    and with syllable-bucketed successors.
+    """
+    bucketed = generator.bucketed
+    results = {}
+    for mode in (False, True):
+        generator.bucketed = mode
+        draws = []
+        started = time.perf_counter()
+        for i in range(lines):
+            generator.draws = 0
+            generator._generate_line(i % 2 == 0)
+            draws.append(generator.draws)
+        results['bucketed' if mode else 'rejection'] = {
+            'draws_per_line': sum(draws) / lines,
+            'max_draws_per_line': max(draws),
+            'ms_per_line': (time.perf_counter() - started) / lines * 1e3,
+        }
+    generator.bucketed = bucketed
+    return results
+
+
+def bench_engines(generator, perashki=100):
+    """
+    Per-perashok latency distribution (ms) of every generation engine.
+    """
+    started = time.perf_counter()
+    for line_syllables in generator.number_of_syllables.values():
+        generator.get_feasibility_table(line_syllables)
+    results = {'feasibility_build_seconds': time.perf_counter() - started}
+    for engine in ENGINES:
+        latencies = []
+        for _ in range(perashki):
+            started = time.perf_counter()
+            generator.generate_perashok(engine)
+            latencies.append((time.perf_counter() - started) * 1e3)
+        results[engine] = percentiles(latencies)
+    return results
+
+
+def bench_rhyme(generator, perashki=200, seed=0):
+    """
+    Per-perashok latency (ms) of every engine without and with rhymed lines 2 and 4,
+    after the feasibility tables and the rhyme index are built.
+    """
+    for line_syllables in generator.number_of_syllables.values():
+        generator.get_feasibility_table(line_syllables)
+    started = time.perf_counter()
+    rhymed_lines = generator.get_rhymed_lines(generator.number_of_syllables[False])
+    results = {'rhyme_index_build_seconds': time.perf_counter() - started,
+               'rhyming_words': len(rhymed_lines.index),
+               'rhyme_classes': len(rhymed_lines.index.classes)}
+    for engine in ENGINES:
+        report = {}
+        for rhyme in (False, True):
+            rng = random.Random(seed)
+            latencies = []
+            for _ in range(perashki):
+                started = time.perf_counter()
+                generator.generate_perashok(engine, rng, rhyme)
+                latencies.append((time.perf_counter() - started) * 1e3)
+            report['rhymed' if rhyme else 'unrhymed'] = percentiles(latencies)
+        report['overhead'] = report['rhymed']['mean'] / report['unrhymed']['mean'] - 1
+        results[engine] = report
+    return results
+
+
+def bench_yo_lookup(letters=(3, 4, 5, 6), words=200, repeats=5):
+    """
+    Permutation beam vs get_yo_forms е/ё lookup (ms per word) on words of the default
+    dictionary with the given numbers of letters 'е' once 'ё' is written as 'е'. get_yo_forms
+    is timed on both dictionary formats, the compact one must not be slower than the trie.
+    """
+    source = os.path.join(settings.BASE_DIR, 'static', 'dicts', 'accents_dict.txt')
+    directory = tempfile.mkdtemp()
+    accents_filename = os.path.join(directory, 'accents_dict')
+    try:
+        shutil.copyfile(source, accents_filename + '.txt')
+        accents_dicts = {accents_format: load_accents_dict(accents_filename, accents_format)
+                         for accents_format in ('trie', 'compact')}
+    finally:
+        shutil.rmtree(directory)
+    groups = {count: [] for count in letters}
+    for key, _ in accents_dicts['trie'].items():
+        word = key.replace('ё', 'е')
+        count = word.count('е')
+        if count in groups and len(groups[count]) < words:
+            groups[count].append(word)
+
+    results = {}
+    for count, group in groups.items():
+        if not group:
+            continue
+        report = {'words': len(group),
+                  'identical': all(beam_yo_accents(word, accents_dicts['trie'])
+                                   == trie_yo_accents(word, accents_dicts['trie'])
+                                   == trie_yo_accents(word, accents_dicts['compact']) for word in group)}
+        for name, function, accents_dict in (('beam', beam_yo_accents, accents_dicts['trie']),
+                                             ('trie', trie_yo_accents, accents_dicts['trie']),
+                                             ('compact', trie_yo_accents, accents_dicts['compact'])):
+            seconds = min(timeit.repeat(lambda: [function(word, accents_dict) for word in group],
+                                        number=1, repeat=repeats))
+            report[name + '_ms_per_word'] = seconds / len(group) * 1e3
+        report['speedup'] = report['beam_ms_per_word'] / report['trie_ms_per_word']
+        report['compact_not_slower'] = report['compact_ms_per_word'] <= report['trie_ms_per_word']
+        results['{}_letters'.format(count)] = report
+    results['compact_not_slower'] = all(report['compact_not_slower'] for report in results.values())
+    return results
+
+
+def resident_memory():
+    # anonymous and file-backed resident memory of the process in kB, Linux only
+    memory = {}
+    with open('/proc/self/status') as status:
+        for line in status:
+            name, _, value = line.partition(':')
+            if name in ('RssAnon', 'RssFile'):
+                memory[name] = int(value.split()[0])
+    return memory
+
+
+def measure_accents_dict(accents_format, accents_filename, words):
+    # runs in a fresh worker process, so the memory is that of one dictionary
+    before = resident_memory()
+    started = time.perf_counter()
+    accents_dict = load_accents_dict(accents_filename, accents_format)
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for word in words:
+        accents_dict.get_accents(word)
+    lookup_seconds = time.perf_counter() - started
+    after = resident_memory()
+    return {'load_seconds': load_seconds,
+            'lookup_us_per_word': lookup_seconds / len(words) * 1e6,
+            'rss_anon_kb': after['RssAnon'] - before['RssAnon'],
+            'rss_file_kb': after['RssFile'] - before['RssFile']}
+
+
+def bench_accent_dicts(lookups=20000, seed=0):
+    """
+    The datrie accent dictionary vs the memory-mapped compact one: build time,
+    file size, load time, resident memory and lookup speed.
+    """
+    source = os.path.join(settings.BASE_DIR, 'static', 'dicts', 'accents_dict.txt')
+    directory = tempfile.mkdtemp()
+    accents_filename = os.path.join(directory, 'accents_dict')
+    try:
+        shutil.copyfile(source, accents_filename + '.txt')
+        started = time.perf_counter()
+        trie_dict = AccentDict(accents_filename)
+        results = {'trie': {'build_seconds': time.perf_counter() - started,
+                            'file_bytes': os.path.getsize(accents_filename + '.trie')},
+                   'compact': {}}
+        for workers in sorted({1, 2, cpu_count()}):
+            started = time.perf_counter()
+            build_accent_store(accents_filename + '.txt', accents_filename + '.accents', workers)
+            results['compact']['build_seconds_workers_{}'.format(workers)] = time.perf_counter() - started
+        results['compact']['file_bytes'] = os.path.getsize(accents_filename + '.accents')
+
+        keys = sorted(key for key, _ in trie_dict.items())
+        compact_dict = load_accents_dict(accents_filename, 'compact')
+        results['identical'] = all(sorted(trie_dict.get_accents(key)) == compact_dict.get_accents(key)
+                                   for key in keys) and len(compact_dict) == len(keys)
+        rng = random.Random(seed)
+        words = [rng.choice(keys) for _ in range(lookups)]
+        for accents_format in ('trie', 'compact'):
+            with Pool(1) as pool:
+                results[accents_format].update(
+                    pool.apply(measure_accents_dict, (accents_format, accents_filename, words)))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_accent_classifier(generator, syllables_numbers=(2, 3, 4, 5), repeats=3):
+    """
+    Per-word vs batch accent classification (us per word) of the vocabulary of the generator
+    with the given numbers of syllables, on classifiers trained on the bundled dictionary.
+    """
+    words = sorted(word for word in generator.get_vocabulary()
+                   if len(Phonetics.get_word_syllables(word)) in syllables_numbers)
+    directory = tempfile.mkdtemp()
+    try:
+        classifier = train_accent_classifiers(directory, get_default_accents_dict(), syllables_numbers)
+        results = {'words': len(words),
+                   'identical': classifier.classify_accents(words) ==
+                   [per_word_accent(classifier, word) for word in words]}
+        groups = defaultdict(list)
+        for word in words:
+            syllables = Phonetics.get_word_syllables(word)
+            groups[len(syllables)].append(syllables)
+        results['identical_features'] = all(
+            np.array_equal(classifier.generate_samples(group),
+                           np.array([classifier.generate_sample(syllables) for syllables in group]))
+            for group in groups.values())
+        for name, function in (
+                ('features_per_word', lambda: [classifier.generate_sample(syllables)
+                                               for group in groups.values() for syllables in group]),
+                ('features_batch', lambda: [classifier.generate_samples(group) for group in groups.values()]),
+                ('per_word', lambda: [per_word_accent(classifier, word) for word in words]),
+                ('batch', lambda: classifier.classify_accents(words))):
+            seconds = min(timeit.repeat(function, number=1, repeat=repeats))
+            results[name + '_us_per_word'] = seconds / len(words) * 1e6
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_batch(sizes=(10, 100, 1000), seed=0):
+    """
+    Batch generation time (ms) of the default model on the calling thread and in process pools.
+    """
+    # load the model and build its feasibility tables before the pools are forked
+    generate_many(10, seed, 1, 'feasible')
+    results = {}
+    for n in sizes:
+        report = {}
+        for workers in sorted({1, 2, cpu_count()}):
+            started = time.perf_counter()
+            generate_many(n, seed, workers, 'feasible')
+            report['workers_{}_ms'.format(workers)] = (time.perf_counter() - started) * 1e3
+        results['n_{}'.format(n)] = report
+    return results
+
+
+def bench_training(foldername='constitution', depth=2):
+    """
+    Serial vs parallel training time on a corpus folder.
+    """
+    perashki = get_corpus_files(foldername)
+    started = time.perf_counter()
+    serial = train_generator(depth, perashki)
+    serial_seconds = time.perf_counter() - started
+    results = {'cpus': cpu_count(), 'serial_seconds': serial_seconds}
+    for workers in sorted({2, 4, cpu_count()} - {1}):
+        started = time.perf_counter()
+        parallel = train_generator(depth, perashki, workers)
+        seconds = time.perf_counter() - started
+        results['workers_{}'.format(workers)] = {
+            'seconds': seconds,
+            'speedup': serial_seconds / seconds,
+            'identical': parallel.frequencies == serial.frequencies,
+        }
+    return results
+
+
+def bench_line_retries(generator, lines=500, seed=0):
+    """
+    Distribution of draws, backtracks and restarts per line of the retry engine.
+    """
+    rng = random.Random(seed)
+    results = {}
+    for is_even_line in (True, False):
+        counts = {'draws': [], 'backtracks': [], 'restarts': []}
+        for _ in range(lines):
+            generator.draws = generator.backtracks = generator.restarts = 0
+            generator._generate_line(is_even_line, rng)
+            counts['draws'].append(generator.draws)
+            counts['backtracks'].append(generator.backtracks)
+            counts['restarts'].append(generator.restarts)
+        results['{}_syllables'.format(generator.number_of_syllables[is_even_line])] = {
+            name: percentiles(values) for name, values in counts.items()}
+    return results
+
+
+def bench_depths(foldername='constitution', depths=(1, 2, 3), perashki=200, seed=0):
+    """
+    Trains the corpus folder at several depths and measures training time, dump
+    sizes, load time, throughput and per-perashok latency (ms) of every engine,
+    and the retries per line.
+    """
+    files = get_corpus_files(foldername)
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for depth in depths:
+            started = time.perf_counter()
+            trained = train_generator(depth, files)
+            trained.compact()
+            report = {'training_seconds': time.perf_counter() - started,
+                      'chains': len(trained.store)}
+
+            dump_filename = os.path.join(directory, 'generator-{}.pickle'.format(depth))
+            trained.dump_self(dump_filename)
+            trained.dump_binary(dump_filename + '.bin')
+            for name, filename in (('pickle', dump_filename), ('binary', dump_filename + '.bin')):
+                report[name + '_bytes'] = os.path.getsize(filename)
+                started = time.perf_counter()
+                loaded = load_generator(filename, depth)
+                report[name + '_load_seconds'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for line_syllables in loaded.number_of_syllables.values():
+                loaded.get_feasibility_table(line_syllables)
+            report['feasibility_build_seconds'] = time.perf_counter() - started
+            for engine in ENGINES:
+                rng = random.Random(seed)
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(perashki):
+                    poem_started = time.perf_counter()
+                    loaded.generate_perashok(engine, rng)
+                    latencies.append((time.perf_counter() - poem_started) * 1e3)
+                report[engine] = {'perashki_per_second': perashki / (time.perf_counter() - started),
+                                  'latency_ms': percentiles(latencies)}
+            report['retry']['line_retries'] = bench_line_retries(loaded, seed=seed)
+            results['depth_{}'.format(depth)] = report
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_counting(foldername='constitution', depths=(1, 2, 3, 4)):
+    """
+    Python vs NumPy n-gram counting over a corpus folder, with phonetics
+    computed beforehand.
+    """
+    fragments = []
+    for perashok_file in get_corpus_files(foldername):
+        fragments += read_fragments(read_lines(perashok_file))
+    phonetic_index = count_fragments(1, fragments)[1]
+
+    results = {'tokens': sum(len(fragment) for fragment in fragments)}
+    for depth in depths:
+        started = time.perf_counter()
+        python = MarkovChainsGenerator(depth)
+        python.phonetic_index = PhoneticIndex(phonetic_index)
+        for fragment in fragments:
+            python.calculate_probabilities(fragment)
+        python_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        frequencies = count_fragments(depth, fragments, PhoneticIndex(phonetic_index))[0]
+        numpy_seconds = time.perf_counter() - started
+        results['depth_{}'.format(depth)] = {
+            'python_seconds': python_seconds,
+            'numpy_seconds': numpy_seconds,
+            'speedup': python_seconds / numpy_seconds,
+            'identical': list(frequencies.items()) == list(python.frequencies.items()),
+        }
+    return results
+
+
+PRUNING_CONFIGURATIONS = (
+    ('full', {}),
+    ('min_count_2', {'min_count': 2}),
+    ('top_20', {'top_k': 20}),
+    ('entropy', {'entropy_threshold': 1e-5}),
+    ('min_count_2_top_20_entropy', {'min_count': 2, 'top_k': 20, 'entropy_threshold': 1e-5}),
+)
+
+
+def bench_pruning(foldername='constitution', depths=(2, 3, 4), lines=200, seed=0):
+    """
+    Size of the compact model against generation success for every pruning mode:
+    the share of retry lines finished without a restart, draws per line and
+    whether both line lengths are feasible.
+    """
+    files = get_corpus_files(foldername)
+    results = {}
+    for depth in depths:
+        trained = train_generator(depth, files)
+        frequencies = trained.get_frequencies()
+        for name, pruning in PRUNING_CONFIGURATIONS:
+            model = MarkovChainsGenerator(depth)
+            model.frequencies = frequencies
+            model.phonetic_index = trained.phonetic_index
+            if pruning:
+                model.prune(**pruning)
+            model.compact()
+            report = {'chains': len(model.store), 'compact_bytes': model.store.footprint()}
+
+            rng = random.Random(seed)
+            restarted, draws = 0, 0
+            started = time.perf_counter()
+            for i in range(lines):
+                model.restarts = model.draws = 0
+                model._generate_line(i % 2 == 0, rng)
+                restarted += model.restarts > 0
+                draws += model.draws
+            report['ms_per_line'] = (time.perf_counter() - started) / lines * 1e3
+            report['first_try_success_rate'] = 1 - restarted / lines
+            report['draws_per_line'] = draws / lines
+            report['feasible'] = all(model.get_feasibility_table(line_syllables).is_feasible()
+                                     for line_syllables in model.number_of_syllables.values())
+            results['depth_{}_{}'.format(depth, name)] = report
+    return results
+
+
+# suites run on the model given to bench_generator, which is loaded only for them
+MODEL_SUITES = {
+    'accent_classifier': bench_accent_classifier,
+    'draws': bench_draws,
+    'engines': bench_engines,
+    'memory': bench_memory,
+    'retries': bench_line_retries,
+    'rhyme': bench_rhyme,
+    'sampler': bench_sampler,
+}
+
+# suites that train, load or build what they measure themselves
+STANDALONE_SUITES = {
+    'accent_dicts': bench_accent_dicts,
+    'batch': bench_batch,
+    'counting': bench_counting,
+    'depths': bench_depths,
+    'pruning': bench_pruning,
+    'training': bench_training,
+    'yo_lookup': bench_yo_lookup,
+}
+
+SUITES = dict(MODEL_SUITES, **STANDALONE_SUITES)
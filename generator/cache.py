@@ -0,0 +1,72 @@
+import random
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .perashki_generator import DEFAULT_DEPTH, DEFAULT_DUMP_FILENAME
+from .registry import registry
+
+
+class PerashkiCache:
+    """
+    Thread-safe LRU cache of generated perashki keyed by (model version, engine, seed).
+
+    A poem is fully determined by its key, so a cached text never goes stale;
+    old model versions simply stop being requested and are evicted.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.perashki = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            text = self.perashki.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.perashki.move_to_end(key)
+            return text
+
+    def put(self, key, text):
+        if not self.size:
+            return
+        with self.lock:
+            self.perashki[key] = text
+            self.perashki.move_to_end(key)
+            while len(self.perashki) > self.size:
+                self.perashki.popitem(last=False)
+
+    def get_stats(self):
+        with self.lock:
+            return {'size': self.size, 'cached': len(self.perashki), 'hits': self.hits, 'misses': self.misses}
+
+
+perashki_cache = PerashkiCache(settings.GENERATOR_CACHE_SIZE)
+
+
+def generate_cached_perashok(loaded, engine, poem_seed):
+    """
+    Generates a perashok with the loaded model and remembers it for permalinks.
+    """
+    text = loaded.generator.generate_perashok(engine, random.Random(poem_seed))
+    perashki_cache.put((loaded.version, engine, poem_seed), text)
+    return text
+
+
+def get_seeded_perashok(version, engine, poem_seed, dump_filename=DEFAULT_DUMP_FILENAME, depth=DEFAULT_DEPTH):
+    """
+    :return text: perashok generated from the seed by the given model version,
+    None if it is neither cached nor the version of the current model
+    """
+    text = perashki_cache.get((version, engine, poem_seed))
+    if text is not None:
+        return text
+    loaded = registry.get_loaded(dump_filename, depth)
+    if loaded.version != version:
+        return None
+    return generate_cached_perashok(loaded, engine, poem_seed)
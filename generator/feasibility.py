@@ -0,0 +1,299 @@
+import random
+import sys
+from array import array
+from bisect import bisect_right
+from collections import Counter, deque
+
+from .ngram_store import CompactNgramStore
+from .sampling import SamplingTable
+
+# approximate memory in bytes of a (chain, syllables) key of the sampling tables cache
+PAIR_SIZE = sys.getsizeof((None, None))
+# stress codes of ChainGraph.stresses for words that fit any stress position
+# and for words of several syllables without a known stress
+ANY_STRESS = -1
+NO_STRESS = -2
+# feasible states of a chain are bits of an 'I' array item, one per syllable count
+MAX_LINE_SYLLABLES = 31
+
+
+class ChainGraph:
+    """
+    Chains of a model and the transitions between them, built once per model and
+    shared by the feasibility tables of all line lengths and rhymes.
+
+    Chains are numbered by their rows in the levels of a CompactNgramStore, level
+    after level, followed by the chains lines reach that have no successors of their
+    own. Successors and counts are read from the store arrays, which stay memory-mapped
+    for binary models; the graph adds flat integer arrays only: the chain every
+    successor entry leads to, the chain it starts from, its token, and the entries
+    leading to every chain.
+    """
+    def __init__(self, sampler, phonetic_index, depth, backoff=False):
+        """
+        :param sampler: CompactNgramStore of the model, or SamplingTables, which are packed first
+        :param phonetic_index: PhoneticIndex covering the vocabulary
+        :param backoff: continue from the longest known suffix of a chain that was pruned
+        """
+        # only a packed copy is counted in the footprint, the store of the model is counted with it
+        self.packed = not isinstance(sampler, CompactNgramStore)
+        if self.packed:
+            sampler = CompactNgramStore.from_items(sampler.items(), depth)
+        self.store = sampler
+        levels = sampler.levels
+        self.chain_starts, self.entry_starts = [0], [0]
+        for level in levels:
+            self.chain_starts.append(self.chain_starts[-1] + len(level))
+            self.entry_starts.append(self.entry_starts[-1] + level.offsets[len(level)])
+        self.root = 0 if len(levels[0]) else None
+
+        rows = {}
+        for order, level in enumerate(levels):
+            for row in range(len(level)):
+                rows[level.key(row)] = self.chain_starts[order] + row
+        # chains without successors, numbered after the rows
+        self.dead_ends = []
+        dead_end_numbers = {}
+        self.next_chains, self.sources, self.tokens = array('I'), array('I'), array('I')
+        for order, level in enumerate(levels):
+            for row in range(len(level)):
+                key = level.key(row)
+                for position in range(level.offsets[row], level.offsets[row + 1]):
+                    token = level.successors[position]
+                    next_key = (key + (token,))[-depth:]
+                    if backoff:
+                        while len(next_key) > 1 and next_key not in rows:
+                            next_key = next_key[1:]
+                    number = rows.get(next_key)
+                    if number is None:
+                        number = dead_end_numbers.get(next_key)
+                    if number is None:
+                        number = self.chain_starts[-1] + len(self.dead_ends)
+                        dead_end_numbers[next_key] = number
+                        self.dead_ends.append(next_key)
+                    self.next_chains.append(number)
+                    self.sources.append(self.chain_starts[order] + row)
+                    self.tokens.append(token)
+
+        # entries leading to every chain, in CSR layout
+        self.predecessor_offsets = array('I', bytes(4 * (len(self) + 1)))
+        for number in self.next_chains:
+            self.predecessor_offsets[number + 1] += 1
+        for number in range(len(self)):
+            self.predecessor_offsets[number + 1] += self.predecessor_offsets[number]
+        free = array('I', self.predecessor_offsets)
+        self.predecessors = array('I', bytes(4 * len(self.next_chains)))
+        for entry, number in enumerate(self.next_chains):
+            self.predecessors[free[number]] = entry
+            free[number] += 1
+
+        self.syllables, self.stresses, self.alpha = array('B'), array('h'), array('B')
+        for token in sampler.vocabulary.tokens:
+            entry = phonetic_index[token]
+            self.syllables.append(min(entry.syllables, 255))
+            if entry.syllables < 2:
+                self.stresses.append(ANY_STRESS)
+            else:
+                self.stresses.append(entry.stresses[0] if entry.stresses else NO_STRESS)
+            self.alpha.append(token.isalpha())
+
+    def __len__(self):
+        return self.chain_starts[-1] + len(self.dead_ends)
+
+    def _locate(self, number):
+        # level and row of a chain, None for dead ends
+        order = bisect_right(self.chain_starts, number) - 1
+        if order >= len(self.store.levels):
+            return None, None
+        return order, number - self.chain_starts[order]
+
+    def key(self, number):
+        order, row = self._locate(number)
+        if order is None:
+            return self.dead_ends[number - self.chain_starts[-1]]
+        return self.store.levels[order].key(row)
+
+    def chain(self, number):
+        return tuple(self.store.vocabulary[token] for token in self.key(number))
+
+    def last_token(self, number):
+        return self.store.vocabulary[self.key(number)[-1]]
+
+    def successors(self, number):
+        """
+        :return successors: iterator over (entry, token id, count) of the chain, in row order
+        """
+        order, row = self._locate(number)
+        if order is None:
+            return
+        level = self.store.levels[order]
+        entry = self.entry_starts[order] + level.offsets[row]
+        for token, count in level.row_counts(row):
+            yield entry, token, count
+            entry += 1
+
+    def predecessor_entries(self, number):
+        return self.predecessors[self.predecessor_offsets[number]:self.predecessor_offsets[number + 1]]
+
+    def has_predecessors(self, number):
+        return self.predecessor_offsets[number] < self.predecessor_offsets[number + 1]
+
+    def is_token_legal(self, number, token, syllables):
+        if number == self.root and not self.alpha[token]:
+            return False
+        stress = self.stresses[token]
+        if stress == ANY_STRESS:
+            return True
+        return stress != NO_STRESS and (syllables + stress) % 2 == 1
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes of the arrays the graph adds to the store,
+        and of the store itself when it was packed from sampling tables
+        """
+        size = sum(sys.getsizeof(values) for values in (
+            self.next_chains, self.sources, self.tokens, self.predecessor_offsets, self.predecessors,
+            self.syllables, self.stresses, self.alpha))
+        size += sys.getsizeof(self.dead_ends) + sum(sys.getsizeof(key) for key in self.dead_ends)
+        if self.packed:
+            size += self.store.footprint()
+        return size
+
+
+class FeasibilityTable:
+    """
+    Reachability over (chain, syllables used) states for lines of a fixed length.
+
+    A state is feasible if some sequence of legal successors leads from it to
+    exactly line_syllables syllables. A successor is legal if the line start
+    allows it and its stress falls on an odd syllable of the line, which is the
+    condition _is_prefix_legal checks for a finished line. The syllables used
+    determine the stress parity, so they are enough to describe the meter state.
+
+    The table is computed once by a backward search from the final states over
+    the ChainGraph of the model, and keeps one bit per state.
+    Generation then samples only among successors leading to feasible states,
+    so a line is built in one pass, without rejected draws or restarts.
+    """
+    def __init__(self, sampler, phonetic_index, depth, line_syllables, is_final_chain=None, backoff=False,
+                 transitions=None):
+        """
+        :param sampler: SamplingTables or CompactNgramStore of the model
+        :param phonetic_index: PhoneticIndex covering the vocabulary
+        :param depth: depth of the Markov model
+        :param line_syllables: number of syllables in the line
+        :param is_final_chain: optional predicate on the chain a line must end with
+        :param backoff: continue from the longest known suffix of a chain that was pruned
+        :param transitions: optional ChainGraph of another table of the same model,
+        so that it is not built again; sampler, depth and backoff are unused then
+        """
+        if line_syllables > MAX_LINE_SYLLABLES:
+            raise ValueError("lines of more than {} syllables are not supported".format(MAX_LINE_SYLLABLES))
+        self.phonetic_index = phonetic_index
+        self.line_syllables = line_syllables
+        self.is_final_chain = is_final_chain
+        self.tables = {}
+        self.transitions = transitions or ChainGraph(sampler, phonetic_index, depth, backoff)
+        graph = self.transitions
+
+        # bit s of feasible[chain] is set if the state (chain, s syllables used) is feasible
+        self.feasible = array('I', bytes(4 * len(graph)))
+        queue = deque()
+        for chain in range(len(graph)):
+            if graph.has_predecessors(chain) and self._is_final(chain):
+                self.feasible[chain] |= 1 << line_syllables
+                queue.append((chain, line_syllables))
+        while queue:
+            next_chain, next_syllables = queue.popleft()
+            for entry in graph.predecessor_entries(next_chain):
+                chain, token = graph.sources[entry], graph.tokens[entry]
+                syllables = next_syllables - graph.syllables[token]
+                if syllables < 0 or self.feasible[chain] >> syllables & 1 \
+                        or not graph.is_token_legal(chain, token, syllables):
+                    continue
+                self.feasible[chain] |= 1 << syllables
+                queue.append((chain, syllables))
+        # shared transitions are counted by the table that built them
+        self.size = sys.getsizeof(self.feasible) + (graph.footprint() if transitions is None else 0)
+
+    def _is_feasible_state(self, chain, syllables):
+        return syllables <= self.line_syllables and self.feasible[chain] >> syllables & 1
+
+    def _is_final(self, chain):
+        return self.is_final_chain is None or self.is_final_chain(self.transitions.chain(chain))
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes of the transitions the table built,
+        its feasible states and the sampling tables of the states generated so far
+        """
+        return self.size
+
+    def is_feasible(self):
+        return self.transitions.root is not None and bool(self.feasible[self.transitions.root] & 1)
+
+    def restrict(self, is_final_chain):
+        """
+        :return table: table of the same lines ending with a chain that satisfies is_final_chain
+        instead, sharing the transitions of this table
+        """
+        return FeasibilityTable(None, self.phonetic_index, None, self.line_syllables, is_final_chain,
+                                transitions=self.transitions)
+
+    def final_tokens(self):
+        """
+        :return tokens: the words generated lines can end with
+        """
+        graph = self.transitions
+        tokens = set()
+        start = (graph.root, 0)
+        visited = {start} if self.is_feasible() else set()
+        queue = deque(visited)
+        while queue:
+            chain, syllables = queue.popleft()
+            if syllables == self.line_syllables and self._is_final(chain):
+                # generation stops at the first final state
+                tokens.add(graph.last_token(chain))
+                continue
+            for entry, token, count in graph.successors(chain):
+                state = (graph.next_chains[entry], syllables + graph.syllables[token])
+                if self._is_feasible_state(*state) and state not in visited \
+                        and graph.is_token_legal(chain, token, syllables):
+                    visited.add(state)
+                    queue.append(state)
+        return tokens
+
+    def _get_table(self, chain, syllables):
+        table = self.tables.get((chain, syllables))
+        if table is None:
+            graph = self.transitions
+            candidates, next_chains = Counter(), {}
+            for entry, token, count in graph.successors(chain):
+                next_chain = graph.next_chains[entry]
+                if self._is_feasible_state(next_chain, syllables + graph.syllables[token]) \
+                        and graph.is_token_legal(chain, token, syllables):
+                    word = graph.store.vocabulary[token]
+                    candidates[word] += count
+                    next_chains[word] = next_chain
+            table = (SamplingTable(candidates), next_chains)
+            self.tables[(chain, syllables)] = table
+            self.size += PAIR_SIZE + table[0].footprint() + sys.getsizeof(next_chains)
+        return table
+
+    def generate_line(self, rng=random):
+        """
+        :return words: list of words of a line with the right meter
+        """
+        if not self.is_feasible():
+            raise ValueError("unable to build a line of {} syllables, "
+                             "make sure your text set contains enough words "
+                             "and try again".format(self.line_syllables))
+        chain, syllables = self.transitions.root, 0
+        words = []
+        while syllables != self.line_syllables or not self._is_final(chain):
+            table, next_chains = self._get_table(chain, syllables)
+            word = table.sample(rng)
+            words.append(word)
+            syllables += self.phonetic_index[word].syllables
+            chain = next_chains[word]
+        return words
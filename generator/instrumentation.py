@@ -0,0 +1,152 @@
+"""
+Hot-path counters and timers of perashki generation.
+
+Instrumentation starts as configured by settings.GENERATOR_INSTRUMENTATION and
+is switched at runtime with generation_stats.enable() and disable(), or by
+sending SIGUSR2 to the web workers, which toggles it. The signal handler is
+installed by the WSGI application only, never by management commands or tests. While it is off, generation pays for
+one flag check per perashok. While it is on, every line fills a LineTrace with
+local counters, and the trace is merged into the process-wide GenerationStats
+once per line. The counters are per process. Every web worker exposes its own
+counters, and the scraper aggregates them.
+"""
+import signal
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+# engine label of the rhymed lines 2 and 4, which come from RhymedLines
+RHYMED_ENGINE = 'rhymed'
+# upper bounds of the line latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float('inf'))
+# number of chains with the most backtracks exposed as separate series
+TOP_CHAINS = 10
+# the tracked chains are cut down to the most frequent ones beyond this size
+MAX_TRACKED_CHAINS = 10000
+COUNTERS = (
+    ('draws', 'Random draws of the lines.'),
+    ('prefix_rejections', 'Lines restarted because their stresses broke the meter.'),
+    ('backtracks', 'Words dropped because no successor fitted the line.'),
+    ('restarts', 'Lines started over from a new first word.'),
+)
+
+
+class LineTrace:
+    """
+    Counters of a single generated line.
+    """
+    __slots__ = ('draws', 'prefix_rejections', 'backtracks', 'restarts', 'backtracked_chains')
+
+    def __init__(self, record_chains=False):
+        self.draws = 0
+        # restarts include the lines restarted because of a prefix rejection
+        self.prefix_rejections = 0
+        self.backtracks = 0
+        self.restarts = 0
+        # chain -> number of times no successor of the chain fitted the line
+        self.backtracked_chains = Counter() if record_chains else None
+
+
+class GenerationStats:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self, *args):
+        self.enabled = not self.enabled
+
+    def reset(self):
+        with self.lock:
+            # (engine, line syllables) -> counters, latency histogram and sums
+            self.lines = Counter()
+            self.counters = Counter()
+            self.buckets = Counter()
+            self.seconds = Counter()
+            self.backtracked_chains = Counter()
+
+    def add_line(self, engine, line_syllables, trace, seconds):
+        """
+        :param engine: label of the engine that generated the line, RHYMED_ENGINE for
+        rhymed lines, whatever the engine of the other lines
+        """
+        labels = (engine, line_syllables)
+        with self.lock:
+            self.lines[labels] += 1
+            self.seconds[labels] += seconds
+            for name, _ in COUNTERS:
+                self.counters[labels + (name,)] += getattr(trace, name)
+            for bound in LATENCY_BUCKETS:
+                if seconds <= bound:
+                    self.buckets[labels + (bound,)] += 1
+            if trace.backtracked_chains:
+                self.backtracked_chains.update(trace.backtracked_chains)
+                if len(self.backtracked_chains) > MAX_TRACKED_CHAINS:
+                    self.backtracked_chains = Counter(dict(
+                        self.backtracked_chains.most_common(MAX_TRACKED_CHAINS // 10)))
+
+    def render(self):
+        """
+        :return text: counters in the Prometheus text exposition format
+        """
+        with self.lock:
+            output = [
+                '# HELP generator_instrumentation_enabled Whether generation is instrumented.',
+                '# TYPE generator_instrumentation_enabled gauge',
+                'generator_instrumentation_enabled {}'.format(int(self.enabled)),
+            ]
+            for name, description in COUNTERS:
+                output.append('# HELP generator_line_{}_total {}'.format(name, description))
+                output.append('# TYPE generator_line_{}_total counter'.format(name))
+                for (engine, line_syllables, counter), value in sorted(self.counters.items()):
+                    if counter == name:
+                        output.append('generator_line_{}_total{{engine="{}",syllables="{}"}} {}'.format(
+                            name, engine, line_syllables, value))
+
+            output.append('# HELP generator_line_seconds Time to generate a line.')
+            output.append('# TYPE generator_line_seconds histogram')
+            for (engine, line_syllables), lines in sorted(self.lines.items()):
+                labels = 'engine="{}",syllables="{}"'.format(engine, line_syllables)
+                for bound in LATENCY_BUCKETS:
+                    output.append('generator_line_seconds_bucket{{{},le="{}"}} {}'.format(
+                        labels, '+Inf' if bound == float('inf') else bound,
+                        self.buckets[(engine, line_syllables, bound)]))
+                output.append('generator_line_seconds_sum{{{}}} {}'.format(
+                    labels, self.seconds[(engine, line_syllables)]))
+                output.append('generator_line_seconds_count{{{}}} {}'.format(labels, lines))
+
+            output.append('# HELP generator_chain_backtracks_total Backtracks of the chains '
+                          'with the most backtracks.')
+            output.append('# TYPE generator_chain_backtracks_total counter')
+            for chain, value in self.backtracked_chains.most_common(TOP_CHAINS):
+                chain = ' '.join(chain).replace('\\', '\\\\').replace('"', '\\"')
+                output.append('generator_chain_backtracks_total{{chain="{}"}} {}'.format(chain, value))
+        return '\n'.join(output) + '\n'
+
+
+generation_stats = GenerationStats(settings.GENERATOR_INSTRUMENTATION)
+
+
+def install_toggle_signal():
+    """
+    Lets SIGUSR2 toggle the instrumentation of the serving process, see perashki.wsgi.
+    :return installed: whether the handler was installed
+    """
+    if not settings.GENERATOR_INSTRUMENTATION_SIGNAL:
+        return False
+    # the server may use the signal itself
+    if signal.getsignal(signal.SIGUSR2) not in (signal.SIG_DFL, None):
+        return False
+    try:
+        signal.signal(signal.SIGUSR2, generation_stats.toggle)
+    except ValueError:
+        # signal handlers can only be installed from the main thread
+        return False
+    return True
@@ -0,0 +1,27 @@
+"""
+Entry point of training processes.
+
+Training processes are spawned, not forked from the web worker: the worker runs
+pool refill threads and holds registry and database locks, and a fork while another
+thread holds a lock leaves the lock held forever in the child. A spawned process
+imports this module in a fresh interpreter before Django is set up, so it must not
+import models at module level.
+"""
+import django
+
+
+def run_training_process(job_id, databases):
+    """
+    :param databases: alias -> database name of the parent process, so that the child
+    works on the same databases, test databases included
+    """
+    django.setup()
+    from django.db import connections
+    from .jobs import run_training_job
+
+    for alias, name in databases.items():
+        connections.databases[alias]['NAME'] = name
+    try:
+        run_training_job(job_id)
+    finally:
+        connections.close_all()
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import traceback
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .job_process import run_training_process
+from .models import TrainingJob
+from .perashki_generator import DEFAULT_CORPUS, DEFAULT_DEPTH, get_dump_filename, train_ngram_model
+
+# training processes start in a fresh interpreter and set Django up themselves, see job_process
+job_context = multiprocessing.get_context('spawn')
+
+
+def start_training_job(foldername=DEFAULT_CORPUS, depth=DEFAULT_DEPTH, dump_filename=None):
+    """
+    Starts training in a separate process unless the model is already being trained.
+    :param dump_filename: the model file, get_dump_filename(foldername, depth) by default
+    :return job: TrainingJob tracking the run
+    """
+    dump_filename = dump_filename or get_dump_filename(foldername, depth)
+    # reap finished training processes
+    multiprocessing.active_children()
+
+    with transaction.atomic():
+        job = TrainingJob.objects.filter(dump_filename=dump_filename,
+                                         status__in=(TrainingJob.PENDING, TrainingJob.RUNNING)).first()
+        if job is not None and is_process_alive(job.pid):
+            return job
+        if job is not None:
+            job.status = TrainingJob.FAILED
+            job.error = 'training process {} exited unexpectedly'.format(job.pid)
+            job.finished_date = timezone.now()
+            job.save()
+        job = TrainingJob.objects.create(foldername=foldername, depth=depth, dump_filename=dump_filename,
+                                         created_date=timezone.now())
+
+    databases = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+    process = job_context.Process(target=run_training_process, args=(job.id, databases))
+    process.start()
+    job.pid = process.pid
+    job.save(update_fields=['pid'])
+    return job
+
+
+def is_process_alive(pid):
+    if pid is None:
+        # the job has just been created and its process is being started
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def run_training_job(job_id):
+    job = TrainingJob.objects.get(id=job_id)
+    job.status = TrainingJob.RUNNING
+    job.started_date = timezone.now()
+    job.save(update_fields=['status', 'started_date'])
+
+    def progress(files_processed, files_total, tokens_counted):
+        job.files_processed = files_processed
+        job.files_total = files_total
+        job.tokens_counted = tokens_counted
+        job.save(update_fields=['files_processed', 'files_total', 'tokens_counted'])
+
+    try:
+        # the model registry switches to the new dump once it replaces the old one
+        train_ngram_model(foldername=job.foldername, dump_filename=job.dump_filename, progress=progress,
+                          depth=job.depth)
+        job.status = TrainingJob.SUCCEEDED
+    except Exception:
+        job.status = TrainingJob.FAILED
+        job.error = traceback.format_exc()
+    finally:
+        job.finished_date = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_date'])
+
+
+def get_job_status(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'foldername': job.foldername,
+        'depth': job.depth,
+        'files_total': job.files_total,
+        'files_processed': job.files_processed,
+        'tokens_counted': job.tokens_counted,
+        'eta_seconds': job.get_eta_seconds(timezone.now()),
+        'created_date': job.created_date.isoformat(),
+        'started_date': job.started_date.isoformat() if job.started_date else None,
+        'finished_date': job.finished_date.isoformat() if job.finished_date else None,
+        'error': job.error,
+    }
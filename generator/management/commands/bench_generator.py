@@ -0,0 +1,47 @@
+import json
+import platform
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from generator.benchmarks import MODEL_SUITES, SUITES, load_generator
+from generator.perashki_generator import DEFAULT_DUMP_FILENAME
+
+
+class Command(BaseCommand):
+    help = 'Runs generator benchmarks and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', default=sorted(SUITES),
+                            help='benchmark suites to run: {}'.format(', '.join(sorted(SUITES))))
+        parser.add_argument('--model', default=DEFAULT_DUMP_FILENAME,
+                            help='dumped generator to benchmark with: {}'.format(', '.join(sorted(MODEL_SUITES))))
+
+    def handle(self, *args, **options):
+        for suite in options['suites']:
+            if suite not in SUITES:
+                print('Unknown suite \"{}\". Available suites: {}'.format(suite, ', '.join(sorted(SUITES))))
+                exit(0)
+        generator = None
+        if any(suite in MODEL_SUITES for suite in options['suites']):
+            generator = load_generator(options['model'])
+        results = {'meta': get_run_metadata()}
+        for suite in options['suites']:
+            results[suite] = MODEL_SUITES[suite](generator) if suite in MODEL_SUITES else SUITES[suite]()
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+def get_run_metadata():
+    # lets runs on different commits be compared
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                         stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
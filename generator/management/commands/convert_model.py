@@ -0,0 +1,21 @@
+from os.path import splitext
+
+from django.core.management.base import BaseCommand
+
+from generator.perashki_generator import DEFAULT_DUMP_FILENAME, BINARY_EXTENSION, PICKLE_EXTENSION, \
+    convert_to_binary
+
+
+class Command(BaseCommand):
+    help = 'Converts a pickled generator dump into the memory-mapped binary model format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=splitext(DEFAULT_DUMP_FILENAME)[0] + PICKLE_EXTENSION,
+                            help='pickled generator dump')
+        parser.add_argument('target', nargs='?', help='binary model, <source name>.bin by default, '
+                                                      'the file served with GENERATOR_BINARY_MODELS on')
+
+    def handle(self, *args, **options):
+        target = options['target'] or splitext(options['source'])[0] + BINARY_EXTENSION
+        convert_to_binary(options['source'], target)
+        print('Binary model written to {}'.format(target))
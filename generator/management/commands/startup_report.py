@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter, so that nothing is imported or loaded beforehand
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'perashki.settings')
+started = time.perf_counter()
+import django
+django.setup()
+setup_seconds = time.perf_counter() - started
+started = time.perf_counter()
+import perashki.urls
+urlconf_seconds = time.perf_counter() - started
+from perashki.resources import get_resources_report
+report = {'setup_seconds': setup_seconds, 'urlconf_seconds': urlconf_seconds,
+          'loaded_at_startup': [name for name, resource in get_resources_report().items() if resource['loaded']]}
+from phonetics.phonetics import Phonetics
+started = time.perf_counter()
+Phonetics.get_word_accent('конституция')
+report['first_accent_seconds'] = time.perf_counter() - started
+report['resources'] = get_resources_report()
+print(json.dumps(report))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Reports import and startup times of a worker and the first-use load times of lazy resources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--imports', type=int, default=15, help='number of slowest imports to report')
+
+    def handle(self, *args, **options):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+                                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                check=True, universal_newlines=True)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        report['slowest_imports_seconds'] = get_slowest_imports(result.stderr, options['imports'])
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+def get_slowest_imports(importtime_output, number):
+    """
+    :return imports: [(module, cumulative seconds)] of the top-level imports taking
+    the most time, from the output of python -X importtime
+    """
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # nested imports are indented, their time is already in the top-level import
+        if not module.startswith('  '):
+            imports.append((module.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:number]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('foldername', models.CharField(max_length=200)),
+                ('dump_filename', models.CharField(max_length=1000)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('files_total', models.IntegerField(default=0)),
+                ('files_processed', models.IntegerField(default=0)),
+                ('tokens_counted', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('pid', models.IntegerField(null=True)),
+                ('created_date', models.DateTimeField(verbose_name='date created')),
+                ('started_date', models.DateTimeField(null=True, verbose_name='date started')),
+                ('finished_date', models.DateTimeField(null=True, verbose_name='date finished')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0002_trainingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perashok',
+            name='engine',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='perashok',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='perashok',
+            name='seed',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
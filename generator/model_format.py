@@ -0,0 +1,150 @@
+"""
+Versioned binary model format that can be memory-mapped read-only.
+
+Layout, all integers little-endian:
+
+    header     magic, format version, depth, vocabulary size, number of sections,
+               payload size and crc32 of everything after the header
+    sections   table of (offset, size, typecode) for every section
+    payload    sections, each aligned to 8 bytes:
+               vocabulary        utf-8 tokens separated by newlines
+               syllables         'B' per token
+               parity            'b' per token
+               can_start         'B' per token
+               stress_offsets    'I' per token + 1, rows of the stresses section
+               stresses          'B' syllable offsets of the possible stresses
+               per chain length from 0 to depth: keys, offsets, successors,
+               cumulative ('I') and successor syllables ('B') of NgramLevel
+               options           'B' flags of the generator, optional: backoff
+               training          utf-8 JSON of the manifest and pruning options
+                                 the model was trained with, optional
+
+The chain and successor tables are memoryviews into the mapping, so all the
+worker processes that map the same file share its pages.
+"""
+import json
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+from .ngram_store import CompactNgramStore, NgramLevel, Vocabulary
+from .phonetic_index import PhoneticIndex, WordPhonetics
+
+MAGIC = b'PRSK'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIIQI')
+SECTION = struct.Struct('<QQ4s')
+ALIGNMENT = 8
+
+
+class ModelFormatError(ValueError):
+    pass
+
+
+def is_binary_model(filename):
+    with open(filename, 'rb') as model_file:
+        return model_file.read(len(MAGIC)) == MAGIC
+
+
+def _phonetic_sections(tokens, phonetic_index):
+    syllables, parity, can_start = array('B'), array('b'), array('B')
+    stress_offsets, stresses = array('I', [0]), array('B')
+    for token in tokens:
+        entry = phonetic_index[token]
+        syllables.append(min(entry.syllables, 255))
+        parity.append(entry.parity)
+        can_start.append(entry.can_start)
+        stresses.extend(min(stress, 255) for stress in entry.stresses)
+        stress_offsets.append(len(stresses))
+    return [syllables, parity, can_start, stress_offsets, stresses]
+
+
+def write_model(filename, store, phonetic_index, backoff=False, manifest=None, pruning=None):
+    """
+    :param manifest: trained corpus file -> content hash, see MarkovChainsGenerator.update_from_files
+    :param pruning: options of MarkovChainsGenerator.prune the counts were pruned with
+    """
+    if sys.byteorder != 'little':
+        raise ModelFormatError("binary models can only be written on little-endian machines")
+    tokens = store.vocabulary.tokens
+    sections = [array('B', '\n'.join(tokens).encode('utf-8'))]
+    sections += _phonetic_sections(tokens, phonetic_index)
+    for level in store.levels:
+        sections += [values if isinstance(values, array) else array(values.format, values)
+                     for values in level.arrays()]
+    sections.append(array('B', [backoff]))
+    training = {'manifest': manifest or {}, 'pruning': pruning}
+    sections.append(array('B', json.dumps(training, ensure_ascii=False, sort_keys=True).encode('utf-8')))
+
+    table_size = SECTION.size * len(sections)
+    offset = HEADER.size + table_size
+    table, payload = [], []
+    for values in sections:
+        padding = -offset % ALIGNMENT
+        payload.append(b'\0' * padding)
+        offset += padding
+        data = values.tobytes()
+        table.append(SECTION.pack(offset, len(data), values.typecode.encode('ascii').ljust(4, b'\0')))
+        payload.append(data)
+        offset += len(data)
+
+    body = b''.join(table) + b''.join(payload)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, store.depth, len(tokens), len(sections),
+                         len(body), zlib.crc32(body))
+    with open(filename, 'wb') as model_file:
+        model_file.write(header)
+        model_file.write(body)
+
+
+def read_model(filename, verify=True):
+    """
+    Maps a binary model read-only.
+    :param verify: compare the checksum, this touches every page of the file once
+    :return (store, phonetic_index, options): CompactNgramStore backed by the mapping,
+    the PhoneticIndex of its vocabulary and the dict of generator options: backoff,
+    manifest and pruning
+    """
+    with open(filename, 'rb') as model_file:
+        mapping = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapping)
+    if len(buffer) < HEADER.size:
+        raise ModelFormatError("{} is too short to be a model".format(filename))
+    magic, version, depth, vocabulary_size, sections_number, body_size, checksum = \
+        HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ModelFormatError("{} is not a binary model".format(filename))
+    if version != FORMAT_VERSION:
+        raise ModelFormatError("unsupported model format version {}".format(version))
+    if HEADER.size + body_size != len(buffer):
+        raise ModelFormatError("{} is truncated".format(filename))
+    if verify and zlib.crc32(buffer[HEADER.size:]) != checksum:
+        raise ModelFormatError("checksum mismatch in {}".format(filename))
+
+    sections = []
+    for i in range(sections_number):
+        offset, size, typecode = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        sections.append(buffer[offset:offset + size].cast(typecode.rstrip(b'\0').decode('ascii')))
+
+    tokens = bytes(sections[0]).decode('utf-8').split('\n') if vocabulary_size else []
+    syllables, parity, can_start, stress_offsets, stresses = sections[1:6]
+    phonetic_index = PhoneticIndex()
+    for token_id, token in enumerate(tokens):
+        phonetic_index[token] = WordPhonetics(
+            syllables[token_id],
+            tuple(stresses[stress_offsets[token_id]:stress_offsets[token_id + 1]]),
+            parity[token_id],
+            bool(can_start[token_id]))
+
+    levels = []
+    for order in range(depth + 1):
+        arrays = sections[6 + 5 * order:11 + 5 * order]
+        levels.append(NgramLevel(order, *arrays))
+    # models written before the options and training sections were added have the defaults
+    options = {'backoff': False, 'manifest': {}, 'pruning': None}
+    if sections_number > 11 + 5 * depth:
+        options['backoff'] = bool(sections[11 + 5 * depth][0])
+    if sections_number > 12 + 5 * depth:
+        options.update(json.loads(bytes(sections[12 + 5 * depth]).decode('utf-8')))
+    return CompactNgramStore(depth, Vocabulary(tokens), levels), phonetic_index, options
@@ -4,4 +4,43 @@ from django.db import models
 class Perashok(models.Model):
     perashok_text = models.CharField(max_length=1000)
     adding_date = models.DateTimeField('date saved')
+    # the poem can be regenerated from its seed while its model version is current
+    seed = models.BigIntegerField(null=True)
+    model_version = models.CharField(max_length=40, blank=True)
+    engine = models.CharField(max_length=20, blank=True)
 
+
+
+class TrainingJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (SUCCEEDED, 'succeeded'),
+        (FAILED, 'failed'),
+    )
+
+    foldername = models.CharField(max_length=200)
+    depth = models.IntegerField(default=2)
+    dump_filename = models.CharField(max_length=1000)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    files_total = models.IntegerField(default=0)
+    files_processed = models.IntegerField(default=0)
+    tokens_counted = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    pid = models.IntegerField(null=True)
+    created_date = models.DateTimeField('date created')
+    started_date = models.DateTimeField('date started', null=True)
+    finished_date = models.DateTimeField('date finished', null=True)
+
+    def is_active(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def get_eta_seconds(self, now):
+        if self.status != self.RUNNING or not self.files_processed or self.started_date is None:
+            return None
+        elapsed = (now - self.started_date).total_seconds()
+        return elapsed / self.files_processed * (self.files_total - self.files_processed)
@@ -0,0 +1,102 @@
+"""
+Vectorized n-gram counting, the NumPy counterpart of calculate_probabilities.
+
+The fragments are encoded as one array of token ids. Every window of the
+stream gets a dense id, computed from the id of the window one token shorter
+and the next token, so np.unique counts n-grams of any length as plain
+integers. The counted n-grams are read back from shifted views of the array. The stress legality of an n-gram is answered with
+prefix sums over per-position arrays instead of a Python call per chain:
+the n-gram is legal when none of its words lacks a stress and all the stresses
+of its polysyllabic words have the same parity, counted from its first syllable.
+Shifting the count start changes all the parities together, so the parities
+can be taken from the start of the whole stream.
+
+The result has the same counts, in the same insertion order, as the Python
+trainer, so sampling from either model gives the same poems.
+"""
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from .phonetic_index import PhoneticIndex
+
+
+def encode_fragments(fragments):
+    """
+    :return (ids, starts, tokens): token ids of the concatenated fragments, position
+    of the start of the fragment of every token, and the tokens by id in first-seen order
+    """
+    vocabulary = {}
+    ids, starts = [], []
+    for fragment in fragments:
+        start = len(ids)
+        for token in fragment:
+            ids.append(vocabulary.setdefault(token, len(vocabulary)))
+        starts.extend([start] * (len(ids) - start))
+    return np.array(ids, dtype=np.int64), np.array(starts, dtype=np.int64), list(vocabulary)
+
+
+def count_fragments(depth, fragments, phonetic_index=None):
+    """
+    Counts the chains of up to depth tokens and their successors within every fragment.
+    :param fragments: iterable of token sequences, n-grams never cross fragments
+    :return (frequencies, phonetic_index, tokens_counted): counts equal to those
+    calculate_probabilities gives, phonetics of the words and number of tokens read
+    """
+    phonetic_index = phonetic_index if phonetic_index is not None else PhoneticIndex()
+    ids, starts, tokens = encode_fragments(fragments)
+    phonetic_index.cover(tokens)
+    size = len(ids)
+    frequencies = defaultdict(Counter)
+    if not size:
+        return frequencies, phonetic_index, 0
+
+    syllables = np.array([phonetic_index[token].syllables for token in tokens], dtype=np.int64)[ids]
+    parity = np.array([phonetic_index[token].parity for token in tokens], dtype=np.int64)[ids]
+    stream_syllables = np.concatenate(([0], np.cumsum(syllables)[:-1]))
+    stressed = syllables > 1
+    stress_parity = (stream_syllables + parity) % 2
+
+    def prefix_sums(mask):
+        return np.concatenate(([0], np.cumsum(mask)))
+
+    unstressed_sums = prefix_sums(stressed & (parity < 0))
+    even_sums = prefix_sums(stressed & (parity >= 0) & (stress_parity == 0))
+    odd_sums = prefix_sums(stressed & (parity >= 0) & (stress_parity == 1))
+
+    positions = np.arange(size)
+    # dense id of the window of the current length starting at every position,
+    # so that n-grams are compared as single integers instead of rows
+    window_ids = ids
+    found = []
+    for length in range(1, depth + 2):
+        if length > 1:
+            window_ids = np.unique(window_ids[:-1] * len(tokens) + ids[length - 1:], return_inverse=True)[1]
+        # windows [first, first + length) that do not cross a fragment start
+        first = positions[:size - length + 1]
+        valid = first == starts[:size - length + 1] if length == 1 else first >= starts[length - 1:]
+        first = first[valid]
+        last = first + length
+        legal = (unstressed_sums[last] == unstressed_sums[first]) & \
+            ((even_sums[last] == even_sums[first]) | (odd_sums[last] == odd_sums[first]))
+        first = first[legal]
+        if not len(first):
+            continue
+        _, index, counts = np.unique(window_ids[first], return_index=True, return_counts=True)
+        first = first[index]
+        ngrams = np.stack([ids[first + shift] for shift in range(length)], axis=1)
+        found.append((first + length - 1, length, ngrams, counts))
+
+    if not found:
+        return frequencies, phonetic_index, size
+
+    # the Python trainer meets the n-grams by end position, longest chain first
+    ends = np.concatenate([level[0] for level in found])
+    lengths = np.concatenate([np.full(len(level[0]), level[1]) for level in found])
+    ngrams = [ngram for level in found for ngram in level[2].tolist()]
+    counts = np.concatenate([level[3] for level in found]).tolist()
+    for item in np.lexsort((-lengths, ends)).tolist():
+        ngram = ngrams[item]
+        chain = tuple(tokens[token_id] for token_id in ngram[:-1])
+        frequencies[chain][tokens[ngram[-1]]] = counts[item]
+    return frequencies, phonetic_index, size
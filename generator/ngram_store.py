@@ -0,0 +1,241 @@
+import random
+import sys
+from array import array
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+from .phonetic_index import count_syllables
+
+
+class Vocabulary:
+    """
+    Interns tokens into consecutive integer ids.
+    """
+    def __init__(self, tokens=()):
+        self.tokens = []
+        self.ids = {}
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token):
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            self.ids[token] = token_id
+            self.tokens.append(token)
+        return token_id
+
+    def get_id(self, token):
+        return self.ids.get(token)
+
+    def encode(self, chain):
+        """
+        :return ids: tuple of token ids or None if some token is unknown
+        """
+        ids = tuple(self.ids.get(token) for token in chain)
+        return None if None in ids else ids
+
+    def __getitem__(self, token_id):
+        return self.tokens[token_id]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getstate__(self):
+        return self.tokens
+
+    def __setstate__(self, tokens):
+        self.__init__(tokens)
+
+
+class NgramLevel:
+    """
+    All chains of one length in CSR layout: sorted flat chain keys,
+    row offsets into the successor ids, per-row cumulative counts and
+    successor syllable counts. Successors within a row are ordered
+    by syllable count, so the ones fitting a syllable budget form a prefix.
+    """
+    def __init__(self, order, keys, offsets, successors, cumulative, syllables):
+        self.order = order
+        self.keys = keys
+        self.offsets = offsets
+        self.successors = successors
+        self.cumulative = cumulative
+        self.syllables = syllables
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def key(self, row):
+        return tuple(self.keys[row * self.order:(row + 1) * self.order])
+
+    def find(self, chain_ids):
+        """
+        Binary search of a chain among the sorted keys.
+        :return row: row number or -1 if there is no such chain
+        """
+        if self.order == 0:
+            return 0 if len(self) else -1
+        if self.order == 1:
+            row = bisect_right(self.keys, chain_ids[0]) - 1
+            return row if row >= 0 and self.keys[row] == chain_ids[0] else -1
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < chain_ids:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.key(lo) == chain_ids else -1
+
+    def row_counts(self, row):
+        begin, end = self.offsets[row], self.offsets[row + 1]
+        previous = 0
+        for position in range(begin, end):
+            yield self.successors[position], self.cumulative[position] - previous
+            previous = self.cumulative[position]
+
+    def arrays(self):
+        return self.keys, self.offsets, self.successors, self.cumulative, self.syllables
+
+    def __getstate__(self):
+        # levels of a memory-mapped model are pickled as plain arrays
+        state = dict(self.__dict__)
+        for name, values in state.items():
+            if isinstance(values, memoryview):
+                state[name] = array(values.format, values)
+        return state
+
+
+class CompactNgramStore:
+    """
+    Read-only n-gram model: chain -> successor counts stored in packed arrays
+    of token ids, one NgramLevel per chain length from 0 to depth.
+    """
+    def __init__(self, depth, vocabulary, levels):
+        self.depth = depth
+        self.vocabulary = vocabulary
+        self.levels = levels
+
+    @classmethod
+    def from_frequencies(cls, frequencies, depth):
+        vocabulary = Vocabulary()
+        rows = defaultdict(list)
+        for chain, token_counter in frequencies.items():
+            if not token_counter:
+                continue
+            chain_ids = tuple(vocabulary.add(token) for token in chain)
+            successors = sorted((count_syllables(token), vocabulary.add(token), count)
+                                for token, count in token_counter.items())
+            rows[len(chain)].append((chain_ids, successors))
+        return cls._from_rows(depth, vocabulary, rows)
+
+    @classmethod
+    def from_items(cls, items, depth):
+        """
+        Packs (chain, [(token, count)]) pairs keeping the order of the successors,
+        which must already be ordered by syllable count, as SamplingTables.items() gives them.
+        """
+        vocabulary = Vocabulary()
+        rows = defaultdict(list)
+        for chain, successors in items:
+            if not successors:
+                continue
+            chain_ids = tuple(vocabulary.add(token) for token in chain)
+            rows[len(chain)].append((chain_ids, [(count_syllables(token), vocabulary.add(token), count)
+                                                 for token, count in successors]))
+        return cls._from_rows(depth, vocabulary, rows)
+
+    @classmethod
+    def _from_rows(cls, depth, vocabulary, rows):
+        levels = []
+        for order in range(depth + 1):
+            keys, offsets = array('I'), array('I', [0])
+            successor_ids, cumulative, syllables = array('I'), array('I'), array('B')
+            for chain_ids, successors in sorted(rows[order]):
+                keys.extend(chain_ids)
+                total = 0
+                for token_syllables, token_id, count in successors:
+                    total += count
+                    successor_ids.append(token_id)
+                    cumulative.append(total)
+                    syllables.append(min(token_syllables, 255))
+                offsets.append(len(successor_ids))
+            levels.append(NgramLevel(order, keys, offsets, successor_ids, cumulative, syllables))
+        return cls(depth, vocabulary, levels)
+
+    def _find(self, chain):
+        if len(chain) > self.depth:
+            return None, -1
+        chain_ids = self.vocabulary.encode(chain)
+        if chain_ids is None:
+            return None, -1
+        level = self.levels[len(chain)]
+        return level, level.find(chain_ids)
+
+    def __contains__(self, chain):
+        return self._find(chain)[1] != -1
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def successors(self, chain):
+        """
+        :return successors: list of (token, count) pairs, empty for an unknown chain
+        """
+        level, row = self._find(chain)
+        if row == -1:
+            return []
+        return [(self.vocabulary[token_id], count) for token_id, count in level.row_counts(row)]
+
+    def sample(self, chain, rng=random, max_syllables=None):
+        level, row = self._find(chain)
+        if row == -1:
+            return None
+        begin, end = level.offsets[row], level.offsets[row + 1]
+        if max_syllables is not None:
+            if max_syllables < 0:
+                return None
+            end = bisect_right(level.syllables, max_syllables, begin, end)
+            if end == begin:
+                return None
+        position = bisect_right(level.cumulative, rng.randrange(level.cumulative[end - 1]), begin, end)
+        return self.vocabulary[level.successors[position]]
+
+    def items(self):
+        for level in self.levels:
+            for row in range(len(level)):
+                chain = tuple(self.vocabulary[token_id] for token_id in level.key(row))
+                yield chain, [(self.vocabulary[token_id], count) for token_id, count in level.row_counts(row)]
+
+    def to_frequencies(self):
+        frequencies = defaultdict(Counter)
+        for chain, successors in self.items():
+            frequencies[chain].update(dict(successors))
+        return frequencies
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes, including the vocabulary strings
+        """
+        size = sum(len(values) * values.itemsize for level in self.levels for values in level.arrays())
+        size += sys.getsizeof(self.vocabulary.tokens) + sys.getsizeof(self.vocabulary.ids)
+        size += sum(sys.getsizeof(token) for token in self.vocabulary.tokens)
+        return size
+
+
+def frequencies_footprint(frequencies):
+    """
+    Approximate memory in bytes taken by a chain -> Counter dict,
+    counting every distinct token string once.
+    """
+    size = sys.getsizeof(frequencies)
+    strings = {}
+    for chain, token_counter in frequencies.items():
+        size += sys.getsizeof(chain) + sys.getsizeof(token_counter)
+        for token in chain:
+            strings[id(token)] = token
+        for token, count in token_counter.items():
+            strings[id(token)] = token
+            size += sys.getsizeof(count) if count > 256 else 0
+    return size + sum(sys.getsizeof(token) for token in strings.values())
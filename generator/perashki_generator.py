@@ -1,27 +1,45 @@
-import re
 import argparse
 import unittest
 from collections import Counter, defaultdict
 import random
+import os
 from os import listdir
-from os.path import isfile, join
+from os.path import isfile, join, relpath
 import pickle
-import itertools
-
-from phonetics.phonetics import Phonetics
+import hashlib
+import time
+from functools import partial
+from multiprocessing import Pool
+
+from .sampling import SamplingTable, SamplingTables
+from .ngram_store import CompactNgramStore, frequencies_footprint
+from .phonetic_index import PhoneticIndex
+from .feasibility import FeasibilityTable
+from .model_format import is_binary_model, read_model, write_model
+from .instrumentation import RHYMED_ENGINE, LineTrace, generation_stats
+from .pruning import PRUNING_DEFAULTS, prune_frequencies, prune_to_budget
+from .ngram_counting import count_fragments
+from .rhyme import RhymedLines
+from perashki.corpus import (list_corpus_files, read_fragments, read_line_chunks, read_range_lines,
+                             split_byte_ranges, tokenize, tokenize_without_punctuation)
 
 from django.conf import settings
 
 MAX_RANDOM_ITER = 100
-
-
-def tokenize(line):
-    return [token.lower() for token in re.findall(r"[^\W\d]+|[^\w\s]+|\s+|\d+", line, re.LOCALE & re.UNICODE)]
-
-
-def tokenize_without_punctuation(line):
-    for token in re.findall(r"[а-яА-Я][а-яА-Я\-\s]*", line, re.LOCALE & re.UNICODE):
-        yield itertools.chain(*([t.split('-') for t in token.strip().lower().split()]))
+TRAINING_CHUNK_LINES = 2000
+# parallel training workers read byte ranges of about this size straight from the files
+TRAINING_CHUNK_BYTES = 1 << 18
+# 'retry' builds lines by random draws with backtracking and restarts,
+# 'feasible' samples only paths known to complete a line (see FeasibilityTable)
+ENGINES = ('retry', 'feasible')
+# models are trained into and served from memory-mapped binary dumps instead of pickles,
+# see dump_binary
+BINARY_EXTENSION = '.bin'
+PICKLE_EXTENSION = '.pickle'
+MODEL_EXTENSION = BINARY_EXTENSION if settings.GENERATOR_BINARY_MODELS else PICKLE_EXTENSION
+DEFAULT_DUMP_FILENAME = join(settings.BASE_DIR, 'static', 'generator' + MODEL_EXTENSION)
+DEFAULT_CORPUS = 'constitution'
+DEFAULT_DEPTH = 2
 
 
 def output_tokens(input_stream, args):
@@ -33,15 +51,50 @@ def output_tokens(input_stream, args):
 
 
 class MarkovChainsGenerator:
-    def __init__(self, depth):
+    def __init__(self, depth, bucketed=True, backoff=False):
         self.depth = depth
+        # bucketed generators draw only successors fitting the syllable budget,
+        # otherwise random successors are rejected until one fits
+        self.bucketed = bucketed
+        # pruned models fall back to shorter chains when a chain has no fitting successors
+        self.backoff = backoff
+        # options of prune the counts were pruned with, None for full counts
+        self.pruning = None
         self.frequencies = defaultdict(Counter)
+        self.store = None
+        self.sampler = None
+        self.starters = None
+        self.feasibility_tables = {}
+        self.rhymed_lines = {}
+        # trained corpus file -> content hash of the file, see update_from_files
+        self.manifest = {}
+        self.tokens_counted = 0
+        # random draws, backtracked words and restarted lines of the retry engine
+        self.draws = 0
+        self.backtracks = 0
+        self.restarts = 0
+        self.phonetic_index = PhoneticIndex()
         self.number_of_syllables = { True : 9, False : 8 }
-        self.russian_vowels = "ёуеыаоэяию"                
+
+    def _reset_tables(self):
+        # everything built from the counts, built again on the next draw
+        self.sampler = None
+        self.starters = None
+        self.feasibility_tables = {}
+        self.rhymed_lines = {}
+
+    def _thaw(self):
+        # switches a compacted model back to mutable counts
+        if self.store is not None:
+            self.frequencies = self.store.to_frequencies()
+            self.store = None
+        self._reset_tables()
 
     def calculate_probabilities(self, token_generator):
+        self._thaw()
         current_tokens = []
         for index, token in enumerate(token_generator):
+            self.tokens_counted += 1
             for start in range(len(current_tokens) + 1):
                 chain = tuple(current_tokens[start:])
                 if (len(chain) == 0 and index != 0) or not self._is_chain_legal(list(chain) + [token]):
@@ -52,86 +105,256 @@ class MarkovChainsGenerator:
                 current_tokens.pop(0)
             current_tokens.append(token)
             
+    def merge_counts(self, frequencies, phonetic_index=None, tokens_counted=0):
+        """
+        Adds count shards trained on other parts of the corpus.
+        """
+        self._thaw()
+        for chain, token_counter in frequencies.items():
+            self.frequencies[chain].update(token_counter)
+        if phonetic_index:
+            self.phonetic_index.update(phonetic_index)
+        self.tokens_counted += tokens_counted
+
+    def subtract_counts(self, frequencies):
+        """
+        Removes a count shard, dropping successors and chains left without counts.
+        """
+        self._thaw()
+        for chain, token_counter in frequencies.items():
+            current_counter = self.frequencies.get(chain)
+            if current_counter is None:
+                continue
+            current_counter.subtract(token_counter)
+            for token in token_counter:
+                if current_counter[token] <= 0:
+                    del current_counter[token]
+            if not current_counter:
+                del self.frequencies[chain]
+
+    def update_from_files(self, perashki, shards_directory, workers=1, progress=None):
+        """
+        Incremental training: only files that are new or changed since the last update
+        are counted, files that changed or disappeared have their old counts subtracted.
+        Every file's counts are kept as a shard named by its content hash,
+        the model's manifest records which files it was trained on.
+        :param progress: optional callback(files_processed, files_total, tokens_counted)
+        :return (added, removed): lists of counted and subtracted files
+        """
+        manifest = self.manifest
+        paths = {relpath(perashok_file, settings.BASE_DIR): perashok_file for perashok_file in perashki}
+        current = {name: get_file_hash(perashok_file) for name, perashok_file in paths.items()}
+
+        removed = [name for name, file_hash in manifest.items() if current.get(name) != file_hash]
+        for name in removed:
+            frequencies, _ = load_shard(shards_directory, manifest.pop(name))
+            self.subtract_counts(frequencies)
+
+        added = [name for name, file_hash in current.items() if manifest.get(name) != file_hash]
+        tokens_counted = 0
+        shards = train_shards(self.depth, [paths[name] for name in added], workers)
+        for files_processed, (name, shard) in enumerate(zip(added, shards), 1):
+            dump_shard(shards_directory, current[name], shard.frequencies, shard.phonetic_index)
+            self.merge_counts(shard.frequencies, shard.phonetic_index)
+            manifest[name] = current[name]
+            tokens_counted += shard.tokens_counted
+            if progress is not None:
+                progress(files_processed, len(added), tokens_counted)
+
+        return added, removed
+
     def get_probabilities_table(self):
         probabilities_table = {}
 
-        for chain, token_counter in self.frequencies.items():
+        for chain, token_counter in self.get_frequencies().items():
             size = sum(token_counter.values())
             probabilities_table[' '.join(chain)] = [(token, freq / size)
                                                     for token, freq
                                                     in sorted(token_counter.items())]
         return probabilities_table
 
-    def _make_random_token(self, chain=tuple()):
-        token_counter = self.frequencies[chain]
+    def get_frequencies(self):
+        if self.store is not None:
+            return self.store.to_frequencies()
+        return self.frequencies
+
+    def prune(self, min_count=1, top_k=None, entropy_threshold=None, memory_budget=None):
+        """
+        Prunes the counts, see prune_frequencies, and switches generation to backoff.
+        :param memory_budget: optional size of the compact model in bytes, min_count
+        is raised until the model fits
+        :return min_count: the min_count used
+        """
+        pruning = {'min_count': min_count, 'top_k': top_k,
+                   'entropy_threshold': entropy_threshold, 'memory_budget': memory_budget}
+        frequencies = self.get_frequencies()
+        if memory_budget is None:
+            pruned = prune_frequencies(frequencies, min_count, top_k, entropy_threshold)
+        else:
+            pruned, min_count = prune_to_budget(frequencies, self.depth, memory_budget,
+                                                min_count, top_k, entropy_threshold)
+        self._thaw()
+        self.frequencies = pruned
+        self.backoff = True
+        self.pruning = dict(pruning, min_count=min_count)
+        return min_count
+
+    def compact(self):
+        self.store = CompactNgramStore.from_frequencies(self.frequencies, self.depth)
+        self.frequencies = defaultdict(Counter)
+        # the tables and line starters of the old counts must not be used with the store
+        self._reset_tables()
+
+    def memory_report(self):
+        frequencies = self.get_frequencies()
+        store = self.store or CompactNgramStore.from_frequencies(frequencies, self.depth)
+        return {
+            'chains': len(store),
+            'vocabulary': len(store.vocabulary),
+            'dict_bytes': frequencies_footprint(frequencies),
+            'compact_bytes': store.footprint(),
+        }
+
+    def counts_footprint(self):
+        if self.store is not None:
+            return self.store.footprint()
+        return frequencies_footprint(self.frequencies)
+
+    def tables_footprint(self):
+        """
+        :return size: approximate memory in bytes of what is built from the counts: the phonetic
+        index and the sampling, feasibility and rhyme tables built so far. It grows as the model
+        generates, feasibility tables of pruned models are often larger than the counts.
+        """
+        size = self.phonetic_index.footprint()
+        if self.sampler is not None and self.sampler is not self.store:
+            size += self.sampler.footprint()
+        if self.starters is not None:
+            size += self.starters.footprint()
+        size += sum(table.footprint() for table in list(self.feasibility_tables.values()))
+        size += sum(rhymed_lines.footprint() for rhymed_lines in list(self.rhymed_lines.values()))
+        return size
+
+    def footprint(self):
+        return self.counts_footprint() + self.tables_footprint()
+
+    def get_vocabulary(self):
+        if self.store is not None:
+            return self.store.vocabulary.tokens
+        vocabulary = set()
+        for chain, token_counter in self.frequencies.items():
+            vocabulary.update(chain)
+            vocabulary.update(token_counter)
+        return vocabulary
 
-        if not token_counter:
-            return None
+    def build_phonetic_index(self):
+        self.phonetic_index.cover(self.get_vocabulary())
 
-        size = sum(token_counter.values())
-        random_proportion = random.randint(0, size - 1)
-        current_proportion = 0
-        for token, frequency in token_counter.items():
-            current_proportion += frequency
-            if random_proportion < current_proportion:
-                return token
+    def build_sampling_tables(self):
+        if self.store is not None:
+            self.sampler = self.store
+        else:
+            self.sampler = SamplingTables(self.frequencies)
+        self.feasibility_tables = {}
+        self.rhymed_lines = {}
+        self.starters = SamplingTable(Counter({
+            token: count for token, count in self.sampler.successors(tuple())
+            if token.isalpha() and self._is_first_token_legal(token)}))
+
+    def get_feasibility_table(self, line_syllables):
+        table = self.feasibility_tables.get(line_syllables)
+        if table is None:
+            if self.sampler is None:
+                self.build_sampling_tables()
+            # the tables of all line lengths share the transitions of the model
+            built = next(iter(self.feasibility_tables.values()), None)
+            table = FeasibilityTable(self.sampler, self.phonetic_index, self.depth, line_syllables,
+                                     backoff=self.backoff,
+                                     transitions=built and built.transitions)
+            self.feasibility_tables[line_syllables] = table
+        return table
+
+    def get_rhymed_lines(self, line_syllables):
+        rhymed_lines = self.rhymed_lines.get(line_syllables)
+        if rhymed_lines is None:
+            rhymed_lines = RhymedLines(self.get_feasibility_table(line_syllables))
+            self.rhymed_lines[line_syllables] = rhymed_lines
+        return rhymed_lines
+
+    def _make_random_token(self, chain=tuple(), max_syllables=None, rng=random):
+        if self.sampler is None:
+            self.build_sampling_tables()
+        self.draws += 1
+        return self.sampler.sample(chain, rng, max_syllables)
 
     def _get_number_of_syllables(self, word):
-        counter = Counter(word)
-        return sum([counter[letter] for letter in self.russian_vowels])
+        return self.phonetic_index[word].syllables
             
     def _is_chain_legal(self, chain, is_prefix=False):
         # TODO: check different accent variants
         syllables = 0
-        accents = []
-        if is_prefix:
-            accents.append(-1)
+        previous_accent = -1 if is_prefix else None
         for word in chain:
-            curr_syllables = self._get_number_of_syllables(word)
-            if curr_syllables > 1:
-                curr_accents = Phonetics.get_word_accent(word)
-                if len(curr_accents) == 0:
+            entry = self.phonetic_index[word]
+            if entry.syllables > 1:
+                if not entry.stresses:
                     return False
-                accents.append(syllables + self._get_number_of_syllables(word[:curr_accents[0]]))
-            syllables += curr_syllables
-        
-        # print(chain, accents)
-        for i in range(len(accents) - 1):
-            if (accents[i + 1] - accents[i]) % 2 == 1:
-                return False
+                accent = syllables + entry.stresses[0]
+                if previous_accent is not None and (accent - previous_accent) % 2 == 1:
+                    return False
+                previous_accent = accent
+            syllables += entry.syllables
         return True
 
     def _is_first_token_legal(self, token):
-        if self._get_number_of_syllables(token) < 2:
-            return True
-        accents = Phonetics.get_word_accent(token)
-        for possible_accent in accents:
-            if self._get_number_of_syllables(token[:possible_accent]) % 2 == 1:
-                return True
-        return False
+        return self.phonetic_index[token].can_start
     
     def _is_prefix_legal(self, chain):
         return self._is_chain_legal(chain, is_prefix=True)
             
     def _make_next_token(self, is_even_line, cur_number_of_syllables,
-                         new_sentence_tokens, max_iterations=MAX_RANDOM_ITER):
+                         new_sentence_tokens, max_iterations=MAX_RANDOM_ITER, rng=random):
         chain = tuple(new_sentence_tokens[-self.depth:])
-        new_token = self._make_random_token(chain)
+        if self.bucketed:
+            max_syllables = self.number_of_syllables[is_even_line] - cur_number_of_syllables
+            new_token = self._make_random_token(chain, max_syllables, rng)
+            while new_token is None and self.backoff and len(chain) > 1:
+                chain = chain[1:]
+                new_token = self._make_random_token(chain, max_syllables, rng)
+            return new_token
+
+        new_token = self._make_random_token(chain, rng=rng)
+        while new_token is None and self.backoff and len(chain) > 1:
+            chain = chain[1:]
+            new_token = self._make_random_token(chain, rng=rng)
+        if new_token is None:
+            return None
         iter_count = 1
         while self._get_number_of_syllables(new_token) + cur_number_of_syllables \
                 > self.number_of_syllables[is_even_line]:
-            new_token = self._make_random_token(chain)
+            new_token = self._make_random_token(chain, rng=rng)
             iter_count += 1
             if iter_count > max_iterations:
                 return None
         
         return new_token
 
-    def _make_initial_token(self, max_iterations=MAX_RANDOM_ITER):
-        new_token = self._make_random_token()
+    def _make_initial_token(self, max_iterations=MAX_RANDOM_ITER, max_syllables=None, rng=random):
+        if self.bucketed:
+            if self.sampler is None:
+                self.build_sampling_tables()
+            self.draws += 1
+            new_token = self.starters.sample(rng, max_syllables)
+            if new_token is None:
+                raise ValueError("unable to choose a random word to start with, "
+                                 "make sure your text set contains any words "
+                                 "and try again")
+            return new_token
+
+        new_token = self._make_random_token(rng=rng)
         iteration_count = 0
         while not (new_token.isalpha() and self._is_first_token_legal(new_token)) and iteration_count < max_iterations:
-            new_token = self._make_random_token()
+            new_token = self._make_random_token(rng=rng)
             iteration_count += 1
 
         if iteration_count == max_iterations:
@@ -155,74 +378,364 @@ class MarkovChainsGenerator:
             sentence.append(self._format_token(token, sentence[-1]) if sentence else token)
         return ''.join(sentence).strip()
 
-    def _generate_line(self, is_even_line):
+    def _generate_line(self, is_even_line, rng=random, trace=None):
+        """
+        :param trace: LineTrace to count draws, backtracks and restarts of the line in
+        """
+        if trace is None:
+            trace = LineTrace()
+        line_syllables = self.number_of_syllables[is_even_line]
         words_sequence = None
         while (words_sequence is None) or (not self._is_prefix_legal(words_sequence)):
-            words_sequence = [self._make_initial_token()]
+            if words_sequence is not None:
+                trace.prefix_rejections += 1
+                trace.restarts += 1
+            words_sequence = [self._make_initial_token(max_syllables=line_syllables, rng=rng)]
+            trace.draws += 1
             cur_number_of_syllables = self._get_number_of_syllables(words_sequence[0])
             
             tries_num = 0
-            while cur_number_of_syllables != self.number_of_syllables[is_even_line]:
+            while cur_number_of_syllables != line_syllables:
                 if tries_num >= MAX_RANDOM_ITER:
                     tries_num = 0
-                    words_sequence = [self._make_initial_token()]
+                    trace.restarts += 1
+                    words_sequence = [self._make_initial_token(max_syllables=line_syllables, rng=rng)]
+                    trace.draws += 1
                     cur_number_of_syllables = self._get_number_of_syllables(words_sequence[0])
                 else:
-                    new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence)
+                    new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence, rng=rng)
+                    trace.draws += 1
                     while new_token is None:
                         tries_num += 1
+                        trace.backtracks += 1
+                        if trace.backtracked_chains is not None:
+                            trace.backtracked_chains[tuple(words_sequence[-self.depth:])] += 1
                         poped_word = words_sequence.pop()
                         cur_number_of_syllables -= self._get_number_of_syllables(poped_word)
                         if len(words_sequence) > 0:
-                            new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence)
+                            new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence, rng=rng)
                         else:
-                            words_sequence = [self._make_initial_token()]
+                            words_sequence = [self._make_initial_token(max_syllables=line_syllables, rng=rng)]
+                            trace.draws += 1
                             cur_number_of_syllables = self._get_number_of_syllables(words_sequence[0])
-                            new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence)
+                            new_token = self._make_next_token(is_even_line, cur_number_of_syllables, words_sequence, rng=rng)
+                        trace.draws += 1
                     words_sequence.append(new_token)
                     cur_number_of_syllables += self._get_number_of_syllables(new_token)
 
+        self.backtracks += trace.backtracks
+        self.restarts += trace.restarts
         return ' '.join(words_sequence)
     
-    def generate_perashok(self):
+    def _generate_feasible_line(self, is_even_line, rng=random, trace=None):
+        # feasible lines are drawn in one pass, the trace stays empty
+        table = self.get_feasibility_table(self.number_of_syllables[is_even_line])
+        return ' '.join(table.generate_line(rng))
+
+    def _generate_rhymed_line(self, is_even_line, rng=random, trace=None, rhyme_with=None):
+        # rhymed lines are drawn from rhyme-constrained feasibility tables, the trace stays empty
+        rhymed_lines = self.get_rhymed_lines(self.number_of_syllables[is_even_line])
+        return ' '.join(rhymed_lines.generate_line(rng, rhyme_with))
+
+    def generate_perashok(self, engine='retry', rng=random, rhyme=False):
+        """
+        :param rhyme: make lines 2 and 4 rhyme, they are drawn from feasibility tables
+        whatever the engine
+        """
+        if engine not in ENGINES:
+            raise ValueError("unknown generation engine {}, "
+                             "choose one of {}".format(engine, ', '.join(ENGINES)))
         lines = []
         for i in range(4):
-            lines.append(self._generate_line(i % 2 == 0))
+            line_engine = engine
+            if rhyme and i % 2 == 1:
+                line_engine = RHYMED_ENGINE
+                generate_line = partial(self._generate_rhymed_line,
+                                        rhyme_with=lines[1].split()[-1] if i == 3 else None)
+            else:
+                generate_line = self._generate_feasible_line if engine == 'feasible' else self._generate_line
+            if not generation_stats.enabled:
+                lines.append(generate_line(i % 2 == 0, rng))
+                continue
+            trace = LineTrace(record_chains=True)
+            started = time.perf_counter()
+            lines.append(generate_line(i % 2 == 0, rng, trace))
+            generation_stats.add_line(line_engine, self.number_of_syllables[i % 2 == 0], trace,
+                                      time.perf_counter() - started)
         return '\n'.join(lines)
     
     def dump_self(self, filename):
-        with open(filename, 'wb') as dump_file:
-            pickle.dump(self.frequencies, dump_file)
+        self.build_phonetic_index()
+        dumped = {'depth': self.depth, 'phonetic_index': self.phonetic_index, 'manifest': self.manifest,
+                  'backoff': self.backoff, 'pruning': self.pruning}
+        if self.store is not None:
+            dumped['store'] = self.store
+        else:
+            dumped['frequencies'] = self.frequencies
+        # write a temporary file first so that readers never see a partial dump
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as dump_file:
+            pickle.dump(dumped, dump_file)
+        os.replace(temporary_filename, filename)
             
+    def dump_binary(self, filename):
+        self.build_phonetic_index()
+        store = self.store or CompactNgramStore.from_frequencies(self.frequencies, self.depth)
+        temporary_filename = filename + '.tmp'
+        write_model(temporary_filename, store, self.phonetic_index, self.backoff, self.manifest, self.pruning)
+        os.replace(temporary_filename, filename)
+
+    def dump(self, filename):
+        # the extension decides the format, see get_dump_filename
+        if filename.endswith(BINARY_EXTENSION):
+            self.dump_binary(filename)
+        else:
+            self.dump_self(filename)
+
     def load_dumped(self, filename):
+        if is_binary_model(filename):
+            self.store, self.phonetic_index, options = read_model(filename)
+            self.depth = self.store.depth
+            self.backoff = options['backoff']
+            self.frequencies = defaultdict(Counter)
+            self.manifest = options['manifest']
+            self.pruning = options['pruning']
+            self.build_sampling_tables()
+            return
         with open(filename, 'rb') as dumped_file:
-            self.frequencies = pickle.load(dumped_file)
-
-
-def create_and_dump_generator(depth, foldername, dump_filename):
-    directory = join(settings.BASE_DIR, 'static', foldername)
-    perashki = [join(directory, f) for f in listdir(directory) if isfile(join(directory, f))]
-
+            dumped = pickle.load(dumped_file)
+        if isinstance(dumped, defaultdict):
+            # old dumps contain the bare frequencies dict
+            dumped = {'depth': self.depth, 'frequencies': dumped}
+        self.depth = dumped['depth']
+        self.store = dumped.get('store')
+        self.frequencies = dumped.get('frequencies', defaultdict(Counter))
+        self.phonetic_index = dumped.get('phonetic_index', PhoneticIndex())
+        self.manifest = dumped.get('manifest', {})
+        self.backoff = dumped.get('backoff', False)
+        self.pruning = dumped.get('pruning')
+        self.build_phonetic_index()
+        self.build_sampling_tables()
+
+
+def get_dump_filename(corpus=DEFAULT_CORPUS, depth=DEFAULT_DEPTH):
+    # the default model keeps the dump it had before several models were served
+    if (corpus, depth) == (DEFAULT_CORPUS, DEFAULT_DEPTH):
+        return DEFAULT_DUMP_FILENAME
+    return join(settings.BASE_DIR, 'static', 'generator-{}-{}{}'.format(corpus, depth, MODEL_EXTENSION))
+
+
+def get_corpus_files(foldername):
+    return list_corpus_files(join(settings.BASE_DIR, 'static', foldername))
+
+
+def get_file_hash(filename):
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as input_stream:
+        for block in iter(lambda: input_stream.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_shards_directory(dump_filename):
+    return dump_filename + '.shards'
+
+
+def load_shard(shards_directory, file_hash):
+    with open(join(shards_directory, file_hash + '.pickle'), 'rb') as shard_file:
+        return pickle.load(shard_file)
+
+
+def dump_shard(shards_directory, file_hash, frequencies, phonetic_index):
+    os.makedirs(shards_directory, exist_ok=True)
+    with open(join(shards_directory, file_hash + '.pickle'), 'wb') as shard_file:
+        pickle.dump((frequencies, phonetic_index), shard_file)
+
+
+def prune_shards(shards_directory, manifest):
+    if not os.path.isdir(shards_directory):
+        return
+    used = {file_hash + '.pickle' for file_hash in manifest.values()}
+    for filename in listdir(shards_directory):
+        if filename.endswith('.pickle') and filename not in used:
+            os.remove(join(shards_directory, filename))
+
+
+def get_byte_ranges(perashki, chunk_size=TRAINING_CHUNK_BYTES):
+    return [(perashok_file, start, end) for perashok_file in perashki
+            for start, end in split_byte_ranges(perashok_file, chunk_size)]
+
+
+def count_lines(depth, lines, generator=None, vectorized=settings.GENERATOR_TRAINING_VECTORIZED):
+    """
+    Trains a count shard on a chunk of corpus lines.
+    :param vectorized: count with NumPy, see count_fragments, instead of calculate_probabilities
+    :return (frequencies, phonetic_index, tokens_counted): shard counts,
+    phonetics of its words and number of tokens read
+    """
+    generator = generator or MarkovChainsGenerator(depth)
+    if vectorized:
+        generator.merge_counts(*count_fragments(depth, read_fragments(lines), generator.phonetic_index))
+        return generator.frequencies, generator.phonetic_index, generator.tokens_counted
+    for tokens in read_fragments(lines):
+        generator.calculate_probabilities(tokens)
+    return generator.frequencies, generator.phonetic_index, generator.tokens_counted
+
+
+def count_range(depth, byte_range):
+    """
+    Trains a count shard on the lines of a (filename, start, end) byte range,
+    read by the worker itself.
+    """
+    return count_lines(depth, read_range_lines(*byte_range))
+
+
+def train_generator(depth, perashki, workers=1):
+    """
+    Counts n-grams over the corpus files. With several workers the files are split
+    into byte ranges on line boundaries, each counted by a worker of a process pool
+    reading the range itself; shards are merged in corpus order, so the counts are
+    exactly those of a serial run.
+    """
     generator = MarkovChainsGenerator(depth)
-
-    for perashok_file in perashki:
-        with open(perashok_file, encoding='utf-8') as input_stream:
-            for i, line in enumerate(input_stream.readlines()):
-                line = line.strip()
-                for tokens in tokenize_without_punctuation(line):
-                    generator.calculate_probabilities(tokens)
+    if workers > 1:
+        with Pool(workers) as pool:
+            for shard in pool.imap(partial(count_range, depth), get_byte_ranges(perashki)):
+                generator.merge_counts(*shard)
+    else:
+        for chunk in read_line_chunks(perashki, TRAINING_CHUNK_LINES):
+            count_lines(depth, chunk, generator)
+    return generator
+
+
+def train_shards(depth, perashki, workers=1):
+    """
+    Counts every corpus file separately. With several workers one process pool counts
+    the byte ranges of all the files, see train_generator.
+    :return shards: iterator over the MarkovChainsGenerator of every file, in file order
+    """
+    if workers <= 1:
+        for perashok_file in perashki:
+            yield train_generator(depth, [perashok_file])
+        return
+    byte_ranges = [get_byte_ranges([perashok_file]) for perashok_file in perashki]
+    with Pool(workers) as pool:
+        counted = pool.imap(partial(count_range, depth),
+                            [byte_range for file_ranges in byte_ranges for byte_range in file_ranges])
+        for file_ranges in byte_ranges:
+            generator = MarkovChainsGenerator(depth)
+            for _ in file_ranges:
+                generator.merge_counts(*next(counted))
+            yield generator
+
+
+def create_and_dump_generator(depth, foldername, dump_filename, compact=True, workers=1, pruning=None):
+    generator = train_generator(depth, get_corpus_files(foldername), workers)
     # DEBUG            
     print(generator.get_probabilities_table())
-    
-    generator.dump_self(dump_filename)
-
-
-def train_ngram_model(foldername='constitution', dump_filename=join(settings.BASE_DIR, 'static', 'generator.pickle')):
-    create_and_dump_generator(depth=2, foldername=foldername, dump_filename=dump_filename)
-
 
-def make_random_perashok(foldername='constitution', dump_filename=join(settings.BASE_DIR, 'static', 'generator.pickle')):
-    generator = MarkovChainsGenerator(2)
+    if pruning:
+        generator.prune(**pruning)
+    if compact:
+        generator.compact()
+    generator.dump(dump_filename)
+
+
+def restore_counts(generator, shards_directory):
+    # a pruned model has lost counts, the shards of its manifest still have all of them
+    restored = MarkovChainsGenerator(generator.depth)
+    for file_hash in generator.manifest.values():
+        restored.merge_counts(*load_shard(shards_directory, file_hash))
+    restored.manifest = generator.manifest
+    return restored
+
+
+def update_and_dump_generator(depth, foldername, dump_filename, workers=1, progress=None, pruning=None):
+    """
+    Updates an existing model with the changes in the corpus folder.
+    Without a manifest in the dumped model everything is trained from scratch.
+    The dump is replaced only once the update has succeeded.
+    :param pruning: optional keyword arguments of MarkovChainsGenerator.prune
+    """
+    shards_directory = get_shards_directory(dump_filename)
+    pruning = dict(PRUNING_DEFAULTS, **pruning) if pruning else None
+    generator = MarkovChainsGenerator(depth)
+    if isfile(dump_filename):
+        generator.load_dumped(dump_filename)
+        if generator.depth != depth or not generator.manifest:
+            generator = MarkovChainsGenerator(depth)
+    previous_pruning = generator.pruning
+    if previous_pruning is not None:
+        generator = restore_counts(generator, shards_directory)
+
+    added, removed = generator.update_from_files(get_corpus_files(foldername), shards_directory,
+                                                 workers, progress)
+    if added or removed or not isfile(dump_filename) or pruning != previous_pruning:
+        if pruning:
+            generator.prune(**pruning)
+        generator.compact()
+        generator.dump(dump_filename)
+        prune_shards(shards_directory, generator.manifest)
+    return added, removed
+
+
+def convert_to_binary(dump_filename, binary_filename, depth=2):
+    generator = MarkovChainsGenerator(depth)
     generator.load_dumped(dump_filename)
-    
-    return generator.generate_perashok()
+    generator.dump_binary(binary_filename)
+
+
+def train_ngram_model(foldername=DEFAULT_CORPUS, dump_filename=DEFAULT_DUMP_FILENAME,
+                      workers=settings.GENERATOR_TRAINING_WORKERS, incremental=True, progress=None,
+                      depth=DEFAULT_DEPTH):
+    pruning = settings.GENERATOR_PRUNING.get(depth)
+    if incremental:
+        update_and_dump_generator(depth=depth, foldername=foldername, dump_filename=dump_filename,
+                                  workers=workers, progress=progress, pruning=pruning)
+    else:
+        create_and_dump_generator(depth=depth, foldername=foldername, dump_filename=dump_filename,
+                                  workers=workers, pruning=pruning)
+
+
+def make_poem_seeds(n, seed=None):
+    """
+    Seeds of n perashki; the same batch seed always gives the same poem seeds.
+    """
+    rng = random.Random(seed) if seed is not None else random.SystemRandom()
+    return [rng.getrandbits(48) for _ in range(n)]
+
+
+def generate_seeded_perashok(dump_filename, depth, engine, poem_seed):
+    from .registry import registry
+
+    generator = registry.get(dump_filename, depth)
+    started = time.perf_counter()
+    text = generator.generate_perashok(engine, random.Random(poem_seed))
+    return {'seed': poem_seed, 'text': text, 'seconds': time.perf_counter() - started}
+
+
+def generate_many(n, seed=None, workers=1, engine='retry', dump_filename=DEFAULT_DUMP_FILENAME,
+                  depth=DEFAULT_DEPTH):
+    """
+    Generates n perashki against the already loaded model, reusing its sampling
+    and feasibility tables. With several workers the poems are generated in a process
+    pool forked after the model is loaded, so the workers do not load it again; this is
+    meant for large offline batches, the web server generates on the request thread.
+    :return perashki: list of dicts with the poem seed, text and generation time in seconds
+    """
+    from .registry import registry
+
+    generate = partial(generate_seeded_perashok, dump_filename, depth, engine)
+    seeds = make_poem_seeds(n, seed)
+    if workers > 1 and n > 1:
+        registry.get(dump_filename, depth)
+        with Pool(workers) as pool:
+            return pool.map(generate, seeds, chunksize=max(1, n // (workers * 4)))
+    return [generate(poem_seed) for poem_seed in seeds]
+
+
+def make_random_perashok(foldername=DEFAULT_CORPUS, depth=DEFAULT_DEPTH, engine='retry'):
+    from .registry import registry
+
+    generator = registry.get(get_dump_filename(foldername, depth), depth)
+    return generator.generate_perashok(engine)
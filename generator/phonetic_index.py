@@ -0,0 +1,51 @@
+import sys
+from collections import namedtuple
+
+from phonetics.phonetics import Phonetics
+
+RUSSIAN_VOWELS = "ёуеыаоэяию"
+
+# syllables: number of syllables in the word
+# stresses: syllable offsets of the possible stresses, in dictionary order
+# parity: parity of the first stress offset, -1 for words without a stress
+# can_start: whether a line may start with the word
+WordPhonetics = namedtuple('WordPhonetics', ['syllables', 'stresses', 'parity', 'can_start'])
+# approximate memory in bytes of an entry of a word with one stress
+ENTRY_SIZE = sys.getsizeof(WordPhonetics(2, (1,), 1, True)) + sys.getsizeof((1,))
+
+
+def count_syllables(word):
+    return sum(1 for letter in word if letter in RUSSIAN_VOWELS)
+
+
+def describe_word(word):
+    syllables = count_syllables(word)
+    stresses = ()
+    if syllables > 1:
+        stresses = tuple(count_syllables(word[:accent]) for accent in Phonetics.get_word_accent(word))
+    parity = stresses[0] % 2 if stresses else -1
+    can_start = syllables < 2 or any(stress % 2 == 1 for stress in stresses)
+    return WordPhonetics(syllables, stresses, parity, can_start)
+
+
+class PhoneticIndex(dict):
+    """
+    Vocabulary entry -> WordPhonetics. Entries are computed on first access,
+    so each word goes through the accent dictionary only once.
+    """
+    def __missing__(self, word):
+        entry = describe_word(word)
+        self[word] = entry
+        return entry
+
+    def cover(self, words):
+        for word in words:
+            if word not in self:
+                self[word] = describe_word(word)
+        return self
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes, without the word strings
+        """
+        return sys.getsizeof(self) + len(self) * ENTRY_SIZE
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .cache import generate_cached_perashok
+from .perashki_generator import DEFAULT_DEPTH, DEFAULT_DUMP_FILENAME, make_poem_seeds
+from .registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class PerashkiPool:
+    """
+    Bounded pool of ready perashki for one model, refilled by background threads.
+
+    pop() takes a poem in constant time and falls back to synchronous generation
+    only when the pool is empty. Refill threads sleep until the pool drops to
+    the low-water mark and then fill it up to its size. Poems generated by a model
+    that has since been replaced on disk are dropped instead of being served.
+    """
+    def __init__(self, dump_filename=DEFAULT_DUMP_FILENAME, depth=DEFAULT_DEPTH, engine='retry',
+                 size=10, low_water=3, refill_threads=1):
+        self.dump_filename = dump_filename
+        self.depth = depth
+        self.engine = engine
+        self.size = size
+        self.low_water = low_water
+        self.refill_threads = refill_threads
+        self.perashki = deque()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.generated = 0
+
+    def _generate(self):
+        loaded = registry.get_loaded(self.dump_filename, self.depth)
+        poem_seed = make_poem_seeds(1)[0]
+        started = time.perf_counter()
+        text = generate_cached_perashok(loaded, self.engine, poem_seed)
+        return {'seed': poem_seed, 'version': loaded.version, 'engine': self.engine,
+                'text': text, 'seconds': time.perf_counter() - started}
+
+    def _start(self):
+        self.threads = [threading.Thread(target=self._refill, name='perashki-pool-{}'.format(i), daemon=True)
+                        for i in range(self.refill_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _refill(self):
+        while True:
+            with self.condition:
+                while len(self.perashki) > self.low_water:
+                    self.condition.wait()
+            try:
+                while len(self.perashki) < self.size:
+                    item = self._generate()
+                    with self.condition:
+                        self.generated += 1
+                        if len(self.perashki) < self.size:
+                            self.perashki.append(item)
+            except Exception:
+                logger.exception("refilling the perashki pool of %s failed", self.dump_filename)
+                # the model may be missing or being retrained, wait for the next request
+                with self.condition:
+                    self.condition.wait()
+
+    def pop(self):
+        """
+        :return perashok: dict with the poem seed, model version, engine, text
+        and generation time in seconds
+        """
+        current_version = registry.get_loaded(self.dump_filename, self.depth).version
+        with self.condition:
+            if self.size and not self.threads:
+                self._start()
+            perashok = None
+            while self.perashki and perashok is None:
+                perashok = self.perashki.popleft()
+                if perashok['version'] != current_version:
+                    self.stale += 1
+                    perashok = None
+            if perashok is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if len(self.perashki) <= self.low_water:
+                self.condition.notify_all()
+        if perashok is None:
+            perashok = self._generate()
+        return perashok
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'dump_filename': self.dump_filename,
+                'depth': self.depth,
+                'engine': self.engine,
+                'size': self.size,
+                'low_water': self.low_water,
+                'refill_threads': self.refill_threads,
+                'available': len(self.perashki),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'generated': self.generated,
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(dump_filename=DEFAULT_DUMP_FILENAME, depth=DEFAULT_DEPTH, engine='retry'):
+    with pools_lock:
+        pool = pools.get((dump_filename, engine))
+        if pool is None:
+            pool = PerashkiPool(dump_filename, depth, engine, settings.GENERATOR_POOL_SIZE,
+                                settings.GENERATOR_POOL_LOW_WATER, settings.GENERATOR_POOL_REFILL_THREADS)
+            pools[(dump_filename, engine)] = pool
+        return pool
@@ -0,0 +1,89 @@
+import heapq
+from collections import Counter, defaultdict
+from math import log
+
+from .ngram_store import CompactNgramStore
+
+PRUNING_DEFAULTS = {'min_count': 1, 'top_k': None, 'entropy_threshold': None, 'memory_budget': None}
+
+
+def prune_successors(token_counter, min_count=1, top_k=None):
+    """
+    :return token_counter: successors seen at least min_count times, at most top_k
+    of the most frequent ones, in their original order
+    """
+    items = [(token, count) for token, count in token_counter.items() if count >= min_count]
+    if top_k is not None and len(items) > top_k:
+        kept = {token for token, count in heapq.nsmallest(top_k, items, key=lambda item: (-item[1], item[0]))}
+        items = [(token, count) for token, count in items if token in kept]
+    return Counter(dict(items))
+
+
+def relative_entropy(token_counter, backoff_counter):
+    """
+    Kullback-Leibler divergence between the successors of a chain and of its backoff chain,
+    None if the backoff chain misses some successor.
+    """
+    total = sum(token_counter.values())
+    backoff_total = sum(backoff_counter.values())
+    divergence = 0.0
+    for token, count in token_counter.items():
+        backoff_count = backoff_counter.get(token)
+        if not backoff_count:
+            return None
+        probability = count / total
+        divergence += probability * log(probability * backoff_total / backoff_count)
+    return divergence
+
+
+def prune_frequencies(frequencies, min_count=1, top_k=None, entropy_threshold=None):
+    """
+    Count pruning of a trained frequencies dict. Chains of fewer than two tokens are kept
+    whole: the empty chain holds the line starters and single tokens are what backoff ends with.
+    :param min_count: drop successors seen fewer times
+    :param top_k: keep only the most frequent successors of every chain
+    :param entropy_threshold: drop the chains of two and more tokens whose successors
+    are predicted well enough by the chain without its first token: the share of the chain
+    among the chains of its length times the relative entropy of the two distributions
+    is below the threshold
+    :return pruned: new frequencies dict, for generation with backoff
+    """
+    pruned = defaultdict(Counter)
+    for chain, token_counter in frequencies.items():
+        if len(chain) < 2:
+            token_counter = Counter(token_counter)
+        else:
+            token_counter = prune_successors(token_counter, min_count, top_k)
+        if token_counter:
+            pruned[chain] = token_counter
+
+    if entropy_threshold is not None:
+        totals = Counter()
+        for chain, token_counter in pruned.items():
+            totals[len(chain)] += sum(token_counter.values())
+        # longer chains first, so every chain is compared with a backoff chain that is kept
+        for chain in sorted(pruned, key=len, reverse=True):
+            if len(chain) < 2 or chain[1:] not in pruned:
+                continue
+            token_counter = pruned[chain]
+            divergence = relative_entropy(token_counter, pruned[chain[1:]])
+            if divergence is not None and \
+                    sum(token_counter.values()) / totals[len(chain)] * divergence < entropy_threshold:
+                del pruned[chain]
+    return pruned
+
+
+def prune_to_budget(frequencies, depth, memory_budget, min_count=1, top_k=None, entropy_threshold=None):
+    """
+    Prunes with the given rules, raising min_count by half until the compact store
+    of the model takes at most memory_budget bytes. Only chains of two and more tokens
+    are pruned, so the budget must leave room for the shorter ones.
+    :return (pruned, min_count): pruned frequencies and the min_count that was needed
+    """
+    while True:
+        pruned = prune_frequencies(frequencies, min_count, top_k, entropy_threshold)
+        if CompactNgramStore.from_frequencies(pruned, depth).footprint() <= memory_budget:
+            return pruned, min_count
+        if all(len(chain) < 2 for chain in pruned):
+            raise ValueError("unable to prune the model to {} bytes".format(memory_budget))
+        min_count = max(min_count + 1, min_count * 3 // 2)
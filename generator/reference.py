@@ -0,0 +1,76 @@
+"""
+Reference implementations the optimized code is checked against by the tests and
+compared with by the benchmarks, and the small accent classifiers both of them train.
+"""
+import os
+import random
+
+import numpy as np
+
+from phonetics.phonetics import Phonetics
+from phonetics.preprocess import get_first_vowel_position
+
+
+def linear_sample(token_counter, rng=random):
+    # reference sampler: the one _make_random_token used before sampling tables
+    if not token_counter:
+        return None
+
+    size = sum(token_counter.values())
+    random_proportion = rng.randint(0, size - 1)
+    current_proportion = 0
+    for token, frequency in token_counter.items():
+        current_proportion += frequency
+        if random_proportion < current_proportion:
+            return token
+
+
+def beam_yo_accents(word, accents_dict):
+    # reference lookup: the 2^n е/ё permutations get_word_accent checked before get_yo_forms
+    positions = [i for i in range(len(word)) if word[i] == 'е']
+    beam = [word[:positions[0]]]
+    for i in range(len(positions)):
+        end = positions[i + 1] if i + 1 < len(positions) else len(word)
+        beam = [prefix + letter + word[positions[i] + 1:end] for prefix in beam for letter in 'ёе']
+    return [permutation.find('ё') for permutation in beam
+            if accents_dict.get_accents(permutation) and 'ё' in permutation]
+
+
+def trie_yo_accents(word, accents_dict):
+    return [form.find('ё') for form, accents in accents_dict.get_yo_forms(word) if 'ё' in form]
+
+
+def per_word_accent(classifier, word):
+    # reference classification: one predict call per word on generate_sample features
+    syllables = Phonetics.get_word_syllables(word)
+    sample = np.array(classifier.generate_sample(syllables)).reshape(1, -1)
+    syllable = syllables[classifier.classifiers[len(syllables)].get().predict(sample)[0]]
+    return get_first_vowel_position(syllable.text) + syllable.begin
+
+
+def train_accent_classifiers(model_dir, accents_dict, syllables_numbers=(2, 3, 4, 5)):
+    """
+    Trains classifiers of the words with the given numbers of syllables only, the bundled
+    dictionary has too few long words for AccentClassifier.build_accent_classifiers.
+    :return classifier: AccentClassifier using them
+    """
+    # scikit-learn is loaded only when classifiers are trained
+    from sklearn.externals import joblib
+    from sklearn.tree import DecisionTreeClassifier
+
+    from phonetics.accent_classifier import AccentClassifier
+
+    for syllables_number in syllables_numbers:
+        samples, answers = [], []
+        for word, accents in accents_dict.items():
+            syllables = Phonetics.get_word_syllables(word)
+            if len(syllables) != syllables_number or 'ё' in word:
+                continue
+            for syllable in syllables:
+                for accent in accents:
+                    if syllable.begin <= accent < syllable.end:
+                        samples.append(AccentClassifier.generate_sample(syllables))
+                        answers.append(syllable.number)
+        classifier = DecisionTreeClassifier(random_state=0).fit(samples, answers)
+        joblib.dump(classifier, os.path.join(model_dir, 'clf_{}.pickle'.format(syllables_number)))
+    return AccentClassifier(model_dir, accents_dict)
@@ -0,0 +1,143 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .perashki_generator import MarkovChainsGenerator, DEFAULT_DEPTH, get_dump_filename, get_file_hash
+
+
+class LoadedModel(namedtuple('LoadedModel', ['signature', 'version', 'generator', 'counts_footprint'])):
+    @property
+    def footprint(self):
+        # the tables built from the counts grow as the model generates, so they are measured again
+        return self.counts_footprint + self.generator.tables_footprint()
+
+# length of the model version, a prefix of the dump file sha1
+VERSION_LENGTH = 12
+# times a model is read again when its dump is replaced while it is being loaded
+LOAD_ATTEMPTS = 3
+
+
+def get_file_signature(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def get_model_name(corpus, depth):
+    return '{}-{}'.format(corpus, depth)
+
+
+def get_served_models():
+    """
+    :return models: model name -> (corpus, depth) of every model listed in settings.GENERATOR_MODELS,
+    the default model first
+    """
+    return OrderedDict((get_model_name(corpus, depth), (corpus, depth))
+                       for corpus, depth in settings.GENERATOR_MODELS)
+
+
+class ModelRegistry:
+    """
+    Process-wide LRU cache of loaded generators, one per dump file, and so one
+    per (corpus, depth), see get_dump_filename.
+
+    Every lookup compares the file signature (mtime, size, inode) with the one
+    the model was loaded from. When the file has been replaced, one thread loads
+    the new model while the others keep serving the old one, then the new model
+    is swapped in with a single assignment. Requests that already hold the old
+    generator finish with it.
+
+    The version of a loaded model is derived from the contents of its dump, so
+    the same seed gives the same poem for as long as the model is not retrained.
+
+    Once the models together take more than memory_budget bytes, the least
+    recently used ones are evicted and loaded again on their next request.
+    A model takes the memory of its counts and of the tables generation builds
+    from them as it goes, so the budget is checked again on every request.
+    """
+    def __init__(self, memory_budget=None):
+        self.memory_budget = memory_budget
+        self.models = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def _get_lock(self, filename):
+        with self.lock:
+            return self.locks.setdefault(filename, threading.Lock())
+
+    def get(self, filename, depth=DEFAULT_DEPTH):
+        return self.get_loaded(filename, depth).generator
+
+    def get_loaded(self, filename, depth=DEFAULT_DEPTH):
+        """
+        :return loaded: LoadedModel with the generator and the version of the current model
+        """
+        signature = get_file_signature(filename)
+        loaded = self.models.get(filename)
+        if loaded is not None and loaded.signature == signature:
+            self._touch(filename)
+            return loaded
+
+        lock = self._get_lock(filename)
+        # serve the previous model instead of waiting for a reload in progress
+        if not lock.acquire(blocking=loaded is None):
+            return loaded
+        try:
+            loaded = self.models.get(filename)
+            if loaded is None or loaded.signature != signature:
+                loaded = self._load(filename, depth)
+                with self.lock:
+                    self.models[filename] = loaded
+                    self._evict_cold(filename)
+            return loaded
+        finally:
+            lock.release()
+
+    def _load(self, filename, depth):
+        # the version is hashed and the model read in two passes, a dump replaced
+        # in between would give the model the version of another one
+        for _ in range(LOAD_ATTEMPTS):
+            signature = get_file_signature(filename)
+            version = get_file_hash(filename)[:VERSION_LENGTH]
+            generator = MarkovChainsGenerator(depth)
+            generator.load_dumped(filename)
+            if get_file_signature(filename) == signature:
+                return LoadedModel(signature, version, generator, generator.counts_footprint())
+        raise RuntimeError("{} kept being replaced while it was loaded".format(filename))
+
+    def get_model(self, corpus, depth):
+        return self.get(get_dump_filename(corpus, depth), depth)
+
+    def _touch(self, filename):
+        with self.lock:
+            if filename in self.models:
+                self.models.move_to_end(filename)
+                self._evict_cold(filename)
+
+    def _evict_cold(self, filename):
+        if self.memory_budget is None:
+            return
+        footprints = OrderedDict((model_filename, loaded.footprint) for model_filename, loaded in self.models.items())
+        footprint = sum(footprints.values())
+        for cold_filename, cold_footprint in footprints.items():
+            if footprint <= self.memory_budget:
+                break
+            if cold_filename != filename:
+                del self.models[cold_filename]
+                footprint -= cold_footprint
+
+    def evict(self, filename):
+        with self.lock:
+            self.models.pop(filename, None)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'memory_budget': self.memory_budget,
+                'models': [{'filename': filename, 'version': loaded.version, 'footprint': loaded.footprint}
+                           for filename, loaded in self.models.items()],
+            }
+
+
+registry = ModelRegistry(settings.GENERATOR_MODELS_MEMORY)
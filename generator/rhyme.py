@@ -0,0 +1,120 @@
+"""
+Rhymes of line endings.
+
+Two words rhyme if they are the same from the stressed vowel on, and when they
+end with the stressed vowel, also in the consonant before it. Only the words
+generated lines can actually end with are indexed, so every indexed word has at
+least one other word to rhyme with. The first line of a rhyming pair is drawn
+among lines ending with an indexed word, the second one from a feasibility table
+whose final chains end with a rhyme, so neither of them is found by rejection.
+"""
+import random
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+
+from phonetics.phonetics import Phonetics
+from phonetics.preprocess import get_first_vowel_position
+
+# rhyme-constrained feasibility tables kept per line length, one per word rhymed with
+RHYME_TABLES_CACHE = 256
+
+
+def get_rhyme_key(word, entry):
+    """
+    :param entry: WordPhonetics of the word
+    :return key: the word from its stressed vowel on, None for words without syllables
+    or with an unknown stress
+    """
+    if entry.syllables == 0 or (entry.syllables > 1 and not entry.stresses):
+        return None
+    stress = entry.stresses[0] if entry.stresses else 0
+    syllable = Phonetics.get_word_syllables(word)[stress]
+    position = syllable.begin + get_first_vowel_position(syllable.text)
+    if position == len(word) - 1:
+        # open rhymes like "вода - среда" need the same consonant before the vowel
+        position = max(position - 1, 0)
+    return word[position:]
+
+
+class RhymeIndex:
+    """
+    Rhyme key -> words with this key, for the keys shared by several words.
+    """
+    def __init__(self, words, phonetic_index):
+        classes = defaultdict(set)
+        for word in words:
+            key = get_rhyme_key(word, phonetic_index[word])
+            if key is not None:
+                classes[key].add(word)
+        self.classes = {key: frozenset(rhymes) for key, rhymes in classes.items() if len(rhymes) > 1}
+        self.keys = {word: key for key, rhymes in self.classes.items() for word in rhymes}
+
+    def __contains__(self, word):
+        return word in self.keys
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes, without the word and key strings
+        """
+        return sys.getsizeof(self.classes) + sys.getsizeof(self.keys) + \
+            sum(sys.getsizeof(rhymes) for rhymes in self.classes.values())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rhymes(self, word):
+        """
+        :return words: the indexed words rhyming with the word, except the word itself
+        """
+        key = self.keys.get(word)
+        if key is None:
+            return frozenset()
+        return self.classes[key] - {word}
+
+
+class RhymedLines:
+    """
+    Pairs of rhyming lines of a fixed length, built on the FeasibilityTable of the lines.
+    """
+    def __init__(self, table, cache_size=RHYME_TABLES_CACHE):
+        self.table = table
+        self.index = RhymeIndex(table.final_tokens(), table.phonetic_index)
+        self.first_table = table.restrict(lambda chain: chain[-1] in self.index)
+        self.cache_size = cache_size
+        self.rhyme_tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get_rhyme_table(self, word):
+        with self.lock:
+            table = self.rhyme_tables.get(word)
+            if table is not None:
+                self.rhyme_tables.move_to_end(word)
+                return table
+        rhymes = self.index.rhymes(word)
+        table = self.table.restrict(lambda chain: chain[-1] in rhymes)
+        with self.lock:
+            self.rhyme_tables[word] = table
+            while len(self.rhyme_tables) > self.cache_size:
+                self.rhyme_tables.popitem(last=False)
+        return table
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes of the index and of the cached tables,
+        the transitions of the line table are counted by the table itself
+        """
+        with self.lock:
+            tables = list(self.rhyme_tables.values())
+        return self.index.footprint() + self.first_table.footprint() + \
+            sum(table.footprint() for table in tables)
+
+    def generate_line(self, rng=random, rhyme_with=None):
+        """
+        :param rhyme_with: last word of the line to rhyme with, None for the first line of a pair
+        :return words: list of words of a line ending with a word that has rhymes,
+        or with a rhyme to rhyme_with
+        """
+        if rhyme_with is None:
+            return self.first_table.generate_line(rng)
+        return self._get_rhyme_table(rhyme_with).generate_line(rng)
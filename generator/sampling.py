@@ -0,0 +1,84 @@
+import random
+import sys
+from bisect import bisect_right
+from itertools import accumulate
+
+from .phonetic_index import count_syllables
+
+
+class SamplingTable:
+    """
+    Frozen cumulative-weight table for a single chain.
+
+    Tokens are ordered by syllable count, so the tokens that fit a syllable
+    budget form a prefix of the table. A draw is one randrange over the weight
+    of that prefix and one binary search over the cumulative weights, so nothing
+    is summed, filtered or allocated per draw.
+    """
+    __slots__ = ('tokens', 'cumulative', 'total', 'limits')
+
+    def __init__(self, token_counter):
+        items = sorted(token_counter.items(), key=lambda item: count_syllables(item[0]))
+        self.tokens = tuple(token for token, count in items)
+        self.cumulative = tuple(accumulate(count for token, count in items))
+        self.total = self.cumulative[-1] if self.cumulative else 0
+        # limits[s] is the number of tokens with at most s syllables
+        syllables = [count_syllables(token) for token in self.tokens]
+        self.limits = tuple(bisect_right(syllables, s) for s in range(syllables[-1] + 1)) if syllables else ()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def footprint(self):
+        """
+        :return size: approximate memory in bytes, without the token strings
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.tokens) + sys.getsizeof(self.cumulative)
+        size += sys.getsizeof(self.limits)
+        return size + sum(sys.getsizeof(weight) for weight in self.cumulative if weight > 256)
+
+    def sample(self, rng=random, max_syllables=None):
+        size = len(self.tokens)
+        if max_syllables is not None and max_syllables < len(self.limits):
+            size = self.limits[max_syllables] if max_syllables >= 0 else 0
+        if not size:
+            return None
+        return self.tokens[bisect_right(self.cumulative, rng.randrange(self.cumulative[size - 1]), 0, size)]
+
+
+class SamplingTables:
+    """
+    Sampling tables for every chain of a trained frequencies dict.
+    """
+    def __init__(self, frequencies):
+        self.tables = {chain: SamplingTable(token_counter)
+                       for chain, token_counter in frequencies.items()
+                       if token_counter}
+        self.size = sys.getsizeof(self.tables) + sum(sys.getsizeof(chain) + table.footprint()
+                                                     for chain, table in self.tables.items())
+
+    def __contains__(self, chain):
+        return chain in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def footprint(self):
+        return self.size
+
+    def successors(self, chain):
+        table = self.tables.get(chain)
+        if table is None:
+            return []
+        return [(token, cumulative - previous) for token, cumulative, previous
+                in zip(table.tokens, table.cumulative, (0,) + table.cumulative)]
+
+    def items(self):
+        for chain in self.tables:
+            yield chain, self.successors(chain)
+
+    def sample(self, chain, rng=random, max_syllables=None):
+        table = self.tables.get(chain)
+        if table is None:
+            return None
+        return table.sample(rng, max_syllables)
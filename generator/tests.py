@@ -1,10 +1,43 @@
 import unittest
+from unittest import mock
+import itertools
 import os
+import random
+import pickle
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
 
 from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
 from phonetics.accent_classifier import AccentClassifier
 from phonetics.accent_dict import AccentDict
+from phonetics.accent_store import CompactAccentDict, build_accent_store
 from phonetics.phonetics import Phonetics
+from .reference import linear_sample, beam_yo_accents, trie_yo_accents, per_word_accent, \
+    train_accent_classifiers
+from .sampling import SamplingTable, SamplingTables
+from .ngram_store import CompactNgramStore
+from .perashki_generator import MarkovChainsGenerator, train_generator, generate_many, \
+    tokenize_without_punctuation, update_and_dump_generator, get_file_hash, BINARY_EXTENSION
+from .phonetic_index import PhoneticIndex, WordPhonetics, describe_word
+from .feasibility import FeasibilityTable
+from .rhyme import get_rhyme_key
+from .registry import ModelRegistry, VERSION_LENGTH
+from .model_format import is_binary_model, read_model, write_model
+from .models import Perashok, TrainingJob
+from .jobs import get_job_status, run_training_job, start_training_job
+from .pool import PerashkiPool
+from .instrumentation import RHYMED_ENGINE, generation_stats, install_toggle_signal
+from .pruning import prune_frequencies
+from .ngram_counting import count_fragments
+from perashki.corpus import read_lines, read_range_lines, split_byte_ranges
+from perashki.resources import LazyResource, lazy_resource
 
 
 class TestAccentClassifier(unittest.TestCase):
@@ -14,3 +47,608 @@ class TestAccentClassifier(unittest.TestCase):
 
     def test_accent_classifier(self):
         self.assertEqual(Phonetics.get_word_accent('конституция', self.accent_dict), [7])
+
+    def test_classify_accents(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        classifier = train_accent_classifiers(directory, self.accent_dict, (2, 3))
+        words = ['закон', 'статья', 'конкурс', 'гражданин', 'имущество', 'порядок', 'основание', 'вода']
+        words = [word for word in words if len(Phonetics.get_word_syllables(word)) in (2, 3)]
+        self.assertEqual(classifier.classify_accents(words), [per_word_accent(classifier, word) for word in words])
+        self.assertEqual(classifier.classify_accent('закон'), per_word_accent(classifier, 'закон'))
+        syllables_list = [Phonetics.get_word_syllables(word) for word in ('порядок', 'гражданин', 'ёлочка')]
+        self.assertEqual(classifier.generate_samples(syllables_list).tolist(),
+                         [classifier.generate_sample(syllables) for syllables in syllables_list])
+
+    def test_yo_forms(self):
+        words = [key.replace('ё', 'е') for key in self.accent_dict.data.keys() if 'ё' in key][:300]
+        self.assertTrue(all(trie_yo_accents(word, self.accent_dict) for word in words))
+        for word in words + ['елее', 'ещеее', 'перемещение']:
+            self.assertEqual(trie_yo_accents(word, self.accent_dict), beam_yo_accents(word, self.accent_dict))
+
+    def test_compact_accent_dict(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        accents_filename = os.path.join(directory, 'accents_dict')
+        with open(accents_filename + '.txt', 'w', encoding='utf-8') as output_stream:
+            output_stream.write("абзац#абза'ц\nвесело#ве'село,весело'\nвесёлый#весёлый\nвеселый#весе'лый\n")
+        trie_dict = AccentDict(accents_filename)
+        compact_dict = CompactAccentDict(accents_filename)
+        self.assertEqual(sorted(compact_dict.items()), sorted(trie_dict.items()))
+        self.assertEqual(compact_dict.get_accents('весело'), [1, 5])
+        self.assertEqual(compact_dict.get_accents('весел'), [])
+        for word in ('веселый', 'весёлый', 'весело', 'абзац', 'веселье'):
+            self.assertEqual(compact_dict.get_yo_forms(word), trie_dict.get_yo_forms(word))
+        self.assertEqual(Phonetics.get_word_accent('веселый', compact_dict),
+                         Phonetics.get_word_accent('веселый', trie_dict))
+
+        build_accent_store(accents_filename + '.txt', accents_filename + '.accents', workers=2, chunk_size=16)
+        self.assertEqual(sorted(CompactAccentDict(accents_filename).items()), sorted(trie_dict.items()))
+
+    def test_accent_cache(self):
+        accent_dict = AccentDict(os.path.join(settings.BASE_DIR, "static", "dicts", "accents_dict"))
+        accents = Phonetics.get_accents_batch(['конституция', 'закон', 'конституция', 'в'], accent_dict)
+        self.assertEqual(list(accents), ['конституция', 'закон', 'в'])
+        self.assertEqual(accents['конституция'], [7])
+        self.assertEqual(accents['в'], [])
+        self.assertEqual(Phonetics.get_word_accent('закон', accent_dict), accents['закон'])
+        stats = accent_dict.accent_cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['cached']), (1, 3, 3))
+        accent_dict.update('закон', [1])
+        self.assertEqual(accent_dict.accent_cache.get_stats()['cached'], 0)
+
+
+class TestLazyResource(unittest.TestCase):
+    def test_created_once(self):
+        calls = []
+
+        def factory():
+            time.sleep(0.05)
+            calls.append(1)
+            return object()
+
+        resource = LazyResource('test', factory)
+        self.assertFalse(resource.loaded)
+        values = []
+        threads = [threading.Thread(target=lambda: values.append(resource.get())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, values))), 1)
+        self.assertIs(lazy_resource('test-shared', factory), lazy_resource('test-shared', dict))
+
+
+class TestSamplingTable(unittest.TestCase):
+    def test_same_draws_as_linear_sampler(self):
+        # already ordered by syllables, so the table keeps the counter order
+        token_counter = Counter({'и': 11, 'суд': 3, 'закон': 5, 'право': 1})
+        table = SamplingTable(token_counter)
+        table_rng, linear_rng = random.Random(42), random.Random(42)
+        for _ in range(1000):
+            self.assertEqual(table.sample(table_rng), linear_sample(token_counter, linear_rng))
+
+    def test_syllable_budget(self):
+        table = SamplingTable(Counter({'государство': 1, 'в': 2, 'закон': 5, 'суд': 3}))
+        for _ in range(100):
+            self.assertIn(table.sample(max_syllables=1), ('в', 'суд'))
+            self.assertEqual(table.sample(max_syllables=0), 'в')
+        self.assertIsNone(table.sample(max_syllables=-1))
+        self.assertIsNotNone(table.sample(max_syllables=100))
+
+    def test_empty_chain(self):
+        self.assertIsNone(SamplingTable(Counter()).sample())
+        self.assertIsNone(SamplingTables({}).sample(('закон',)))
+
+
+class TestCompactNgramStore(unittest.TestCase):
+    def setUp(self):
+        self.frequencies = defaultdict(Counter)
+        self.frequencies[tuple()].update({'статья': 2, 'закон': 1})
+        self.frequencies[('статья',)].update({'закон': 3, 'первая': 1})
+        self.frequencies[('статья', 'первая')].update({'закон': 1})
+        self.store = CompactNgramStore.from_frequencies(self.frequencies, 2)
+
+    def test_lookup(self):
+        self.assertEqual(sorted(self.store.successors(('статья',))), [('закон', 3), ('первая', 1)])
+        self.assertEqual(self.store.successors(('закон', 'статья')), [])
+        self.assertEqual(self.store.successors(('конституция',)), [])
+        self.assertIsNone(self.store.sample(('закон',)))
+        self.assertEqual(self.store.sample(('статья', 'первая')), 'закон')
+        self.assertIsNone(self.store.sample(('статья', 'первая'), max_syllables=1))
+        for _ in range(100):
+            self.assertEqual(self.store.sample(('статья',), max_syllables=2), 'закон')
+
+    def test_generate_after_compact(self):
+        generator = train_generator(2, [os.path.join(settings.BASE_DIR, 'static', 'constitution',
+                                                     'constitution.txt')])
+        generator.generate_perashok('feasible', random.Random(0))
+        for _ in range(2):
+            generator.compact()
+            for engine in ('retry', 'feasible'):
+                self.assertEqual(len(generator.generate_perashok(engine, random.Random(1)).split('\n')), 4)
+            self.assertIs(generator.sampler, generator.store)
+            # training more switches back to counts, compacting again must not keep the old tables
+            generator.merge_counts({('закон',): Counter({'и': 1})})
+
+    def test_round_trip(self):
+        self.assertEqual(self.store.to_frequencies(), self.frequencies)
+        self.assertEqual(pickle.loads(pickle.dumps(self.store)).to_frequencies(), self.frequencies)
+
+    def test_binary_format(self):
+        phonetic_index = PhoneticIndex({
+            'статья': WordPhonetics(2, (1,), 1, True),
+            'закон': WordPhonetics(2, (1,), 1, True),
+            'первая': WordPhonetics(3, (0, 2), 0, False),
+        })
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'generator.bin')
+            write_model(filename, self.store, phonetic_index)
+            self.assertTrue(is_binary_model(filename))
+            store, loaded_index, options = read_model(filename)
+            self.assertEqual(options, {'backoff': False, 'manifest': {}, 'pruning': None})
+            self.assertEqual(store.to_frequencies(), self.frequencies)
+            self.assertEqual(loaded_index, phonetic_index)
+            self.assertEqual(store.sample(('статья', 'первая')), 'закон')
+            self.assertEqual(pickle.loads(pickle.dumps(store)).to_frequencies(), self.frequencies)
+
+            write_model(filename, self.store, phonetic_index, True, {'0.txt': 'abc'}, {'min_count': 2})
+            options = read_model(filename)[2]
+            self.assertEqual(options, {'backoff': True, 'manifest': {'0.txt': 'abc'}, 'pruning': {'min_count': 2}})
+
+
+class TestPhoneticIndex(unittest.TestCase):
+    def setUp(self):
+        self.generator = MarkovChainsGenerator(2)
+        self.generator.phonetic_index.update({
+            'закон': WordPhonetics(2, (1,), 1, True),
+            'право': WordPhonetics(2, (0,), 0, False),
+            'и': WordPhonetics(1, (), -1, True),
+            'нечто': WordPhonetics(2, (), -1, False),
+        })
+
+    def test_words_without_vowels(self):
+        self.assertEqual(describe_word('в'), WordPhonetics(0, (), -1, True))
+
+    def test_chain_legality(self):
+        self.assertTrue(self.generator._is_prefix_legal(['закон', 'и', 'и', 'закон']))
+        self.assertFalse(self.generator._is_prefix_legal(['право']))
+        self.assertTrue(self.generator._is_chain_legal(['право', 'право']))
+        self.assertFalse(self.generator._is_chain_legal(['право', 'и', 'право']))
+        self.assertFalse(self.generator._is_chain_legal(['и', 'нечто']))
+
+
+class TestFeasibilityTable(unittest.TestCase):
+    def setUp(self):
+        frequencies = defaultdict(Counter)
+        frequencies[tuple()].update({'и': 1, 'закон': 1})
+        frequencies[('и',)].update({'и': 1, 'закон': 1})
+        frequencies[('закон',)].update({'и': 1})
+        self.sampler = SamplingTables(frequencies)
+        self.phonetic_index = PhoneticIndex({
+            'закон': WordPhonetics(2, (1,), 1, True),
+            'и': WordPhonetics(1, (), -1, True),
+        })
+
+    def test_only_metrical_lines(self):
+        table = FeasibilityTable(self.sampler, self.phonetic_index, 1, 3)
+        lines = {' '.join(table.generate_line(random.Random(seed))) for seed in range(50)}
+        self.assertEqual(lines, {'закон и', 'и и и'})
+
+    def test_final_chain(self):
+        table = FeasibilityTable(self.sampler, self.phonetic_index, 1, 2, lambda chain: chain[-1] == 'закон')
+        self.assertEqual(table.generate_line(), ['закон'])
+        table = FeasibilityTable(self.sampler, self.phonetic_index, 1, 3, lambda chain: chain[-1] == 'закон')
+        self.assertFalse(table.is_feasible())
+        self.assertRaises(ValueError, table.generate_line)
+
+
+    def test_line_lengths_share_transitions(self):
+        generator = MarkovChainsGenerator(1)
+        generator.frequencies = defaultdict(Counter, {tuple(): Counter({'и': 1, 'закон': 1}),
+                                                     ('и',): Counter({'и': 1, 'закон': 1})})
+        generator.phonetic_index.update(self.phonetic_index)
+        short, long = generator.get_feasibility_table(2), generator.get_feasibility_table(3)
+        self.assertIs(short.transitions, long.transitions)
+        self.assertIs(short.restrict(lambda chain: True).transitions, short.transitions)
+        # the shared transitions are counted once, by the table that built them
+        self.assertLess(long.footprint(), short.footprint())
+
+
+class TestRhyme(unittest.TestCase):
+    def test_rhyme_key(self):
+        self.assertEqual(get_rhyme_key('закон', WordPhonetics(2, (1,), 1, True)), 'он')
+        self.assertEqual(get_rhyme_key('вода', WordPhonetics(2, (1,), 1, True)), 'да')
+        self.assertEqual(get_rhyme_key('и', WordPhonetics(1, (), -1, True)), 'и')
+        self.assertIsNone(get_rhyme_key('в', WordPhonetics(0, (), -1, True)))
+
+    def test_rhymed_perashok(self):
+        generator = MarkovChainsGenerator(2)
+        generator.load_dumped(os.path.join(settings.BASE_DIR, 'static', 'generator.pickle'))
+        for engine in ('retry', 'feasible'):
+            for seed in range(5):
+                lines = generator.generate_perashok(engine, random.Random(seed), rhyme=True).split('\n')
+                second, fourth = lines[1].split()[-1], lines[3].split()[-1]
+                self.assertNotEqual(second, fourth)
+                self.assertEqual(get_rhyme_key(second, generator.phonetic_index[second]),
+                                 get_rhyme_key(fourth, generator.phonetic_index[fourth]))
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'generator.pickle')
+        self.dump({'и': 1})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def dump(self, starters):
+        generator = MarkovChainsGenerator(1)
+        generator.frequencies[tuple()].update(starters)
+        generator.phonetic_index.update({token: describe_word(token) for token in starters})
+        generator.dump_self(self.filename)
+
+    def test_reload_on_replace(self):
+        registry = ModelRegistry()
+        generator = registry.get(self.filename)
+        self.assertIs(registry.get(self.filename), generator)
+        self.dump({'в': 1})
+        os.utime(self.filename, ns=(0, 0))
+        reloaded = registry.get(self.filename)
+        self.assertIsNot(reloaded, generator)
+        self.assertEqual(reloaded.get_frequencies()[tuple()], Counter({'в': 1}))
+        self.assertEqual(generator.get_frequencies()[tuple()], Counter({'и': 1}))
+
+    def test_evicts_least_recently_used(self):
+        other_filename = os.path.join(self.directory, 'other.pickle')
+        shutil.copy(self.filename, other_filename)
+        registry = ModelRegistry()
+        footprint = registry.get_loaded(self.filename).footprint
+        registry = ModelRegistry(memory_budget=footprint)
+        registry.get(self.filename)
+        registry.get(other_filename)
+        self.assertEqual(list(registry.models), [other_filename])
+
+    def test_version_of_loaded_model(self):
+        load_dumped = MarkovChainsGenerator.load_dumped
+        replaced = []
+
+        def replace_and_load(generator, filename):
+            # the dump is replaced after its version was hashed
+            if not replaced:
+                replaced.append(filename)
+                self.dump({'в': 1})
+            load_dumped(generator, filename)
+
+        with mock.patch.object(MarkovChainsGenerator, 'load_dumped', replace_and_load):
+            loaded = ModelRegistry().get_loaded(self.filename)
+        self.assertEqual(loaded.version, get_file_hash(self.filename)[:VERSION_LENGTH])
+        self.assertEqual(loaded.generator.get_frequencies()[tuple()], Counter({'в': 1}))
+
+    def test_footprint_includes_tables(self):
+        registry = ModelRegistry()
+        loaded = registry.get_loaded(os.path.join(settings.BASE_DIR, 'static', 'generator.pickle'))
+        footprint = loaded.footprint
+        self.assertEqual(footprint, loaded.generator.footprint())
+        loaded.generator.get_feasibility_table(9)
+        self.assertGreater(loaded.footprint, footprint)
+        footprint = loaded.footprint
+        loaded.generator.generate_perashok('feasible', random.Random(0), rhyme=True)
+        self.assertGreater(loaded.footprint, footprint)
+
+    def test_legacy_dump_depth(self):
+        frequencies = defaultdict(Counter)
+        frequencies[tuple()].update({'и': 1})
+        with open(self.filename, 'wb') as dump_file:
+            pickle.dump(frequencies, dump_file)
+        self.assertEqual(ModelRegistry().get(self.filename, 3).depth, 3)
+
+
+class TestParallelTraining(unittest.TestCase):
+    def test_same_counts_as_serial(self):
+        with tempfile.TemporaryDirectory() as directory:
+            perashki = []
+            for i, text in enumerate(['в дом и сад, на мост и в лес\nи в сад', 'на мост и в дом\nв лес, в лес']):
+                perashki.append(os.path.join(directory, '{}.txt'.format(i)))
+                with open(perashki[-1], 'w', encoding='utf-8') as output_stream:
+                    output_stream.write(text)
+            serial = train_generator(2, perashki)
+            self.assertEqual(serial.frequencies[('в',)], Counter({'дом': 2, 'сад': 1, 'лес': 3}))
+            self.assertEqual(train_generator(2, perashki, workers=2).frequencies, serial.frequencies)
+
+
+class TestCorpusReader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.filename = os.path.join(self.directory, 'perashki.txt')
+        self.lines = ['строка {}\n'.format('ё' * number) for number in range(100)]
+        with open(self.filename, 'w', encoding='utf-8') as output_stream:
+            output_stream.writelines(self.lines)
+
+    def test_read_lines(self):
+        self.assertEqual(list(read_lines(self.filename)), self.lines)
+        self.assertEqual(list(read_lines(self.filename, skip_head=2, skip_tail=1)), self.lines[2:-1])
+        self.assertEqual(list(read_lines(self.filename, skip_tail=200)), [])
+
+    def test_byte_ranges_cover_lines(self):
+        for chunk_size in (1, 100, 1000, 1 << 20):
+            ranges = split_byte_ranges(self.filename, chunk_size)
+            self.assertEqual([line for start, end in ranges
+                              for line in read_range_lines(self.filename, start, end)], self.lines)
+
+
+class TestVectorizedCounting(unittest.TestCase):
+    def test_same_counts_as_calculate_probabilities(self):
+        with open(os.path.join(settings.BASE_DIR, 'static', 'constitution', 'constitution.txt'),
+                  encoding='utf-8') as input_stream:
+            fragments = [list(tokens) for line in itertools.islice(input_stream, 300)
+                         for tokens in tokenize_without_punctuation(line.strip())]
+        for depth in (1, 2, 3):
+            generator = MarkovChainsGenerator(depth)
+            for fragment in fragments:
+                generator.calculate_probabilities(fragment)
+            frequencies, phonetic_index, tokens_counted = count_fragments(depth, fragments)
+            # same chains and successors in the same order, so sampling gives the same poems
+            self.assertEqual([(chain, list(token_counter.items())) for chain, token_counter in frequencies.items()],
+                             [(chain, list(token_counter.items()))
+                              for chain, token_counter in generator.frequencies.items()])
+            self.assertEqual(tokens_counted, generator.tokens_counted)
+
+
+class TestIncrementalTraining(unittest.TestCase):
+    def write(self, name, text):
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as output_stream:
+            output_stream.write(text)
+
+    def update(self, generator, workers=1):
+        perashki = [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))]
+        return generator.update_from_files(perashki, self.shards_directory, workers)
+
+    def test_add_change_and_remove_files(self):
+        with tempfile.TemporaryDirectory() as self.directory, \
+                tempfile.TemporaryDirectory() as self.shards_directory:
+            self.write('0.txt', 'в дом и сад')
+            self.write('1.txt', 'на мост и в лес')
+            generator = MarkovChainsGenerator(2)
+            added, removed = self.update(generator)
+            self.assertEqual((len(added), removed), (2, []))
+
+            self.write('1.txt', 'в лес')
+            self.write('2.txt', 'и в дом')
+            added, removed = self.update(generator)
+            self.assertEqual((len(added), len(removed)), (2, 1))
+            self.assertEqual(self.update(generator), ([], []))
+
+            os.remove(os.path.join(self.directory, '0.txt'))
+            self.update(generator)
+            perashki = [os.path.join(self.directory, name) for name in ('1.txt', '2.txt')]
+            self.assertEqual(generator.frequencies, train_generator(2, perashki).frequencies)
+
+
+    def test_parallel_update(self):
+        with tempfile.TemporaryDirectory() as self.directory, \
+                tempfile.TemporaryDirectory() as self.shards_directory:
+            self.write('0.txt', 'в дом и сад\nна мост и в лес\n' * 50)
+            self.write('1.txt', '')
+            self.write('2.txt', 'и в дом')
+            generator = MarkovChainsGenerator(2)
+            added, _ = self.update(generator, workers=2)
+            self.assertEqual(len(added), 3)
+            perashki = [os.path.join(self.directory, name) for name in ('0.txt', '1.txt', '2.txt')]
+            self.assertEqual(generator.frequencies, train_generator(2, perashki).frequencies)
+
+    def test_binary_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            dump_filename = os.path.join(directory, 'generator' + BINARY_EXTENSION)
+            added, _ = update_and_dump_generator(2, 'constitution', dump_filename, pruning={'min_count': 2})
+            self.assertTrue(is_binary_model(dump_filename))
+            generator = MarkovChainsGenerator(2)
+            generator.load_dumped(dump_filename)
+            self.assertEqual(sorted(generator.manifest), sorted(added))
+            self.assertEqual(generator.pruning['min_count'], 2)
+            # the manifest and pruning options in the dump keep the next update incremental
+            signature = os.stat(dump_filename).st_mtime_ns
+            self.assertEqual(update_and_dump_generator(2, 'constitution', dump_filename, pruning={'min_count': 2}),
+                             ([], []))
+            self.assertEqual(os.stat(dump_filename).st_mtime_ns, signature)
+
+
+class TestTrainingJob(TestCase):
+    def test_run_training_job(self):
+        with tempfile.TemporaryDirectory() as directory:
+            dump_filename = os.path.join(directory, 'generator.pickle')
+            job = TrainingJob.objects.create(foldername='constitution', dump_filename=dump_filename,
+                                             created_date=timezone.now())
+            run_training_job(job.id)
+            job.refresh_from_db()
+            self.assertEqual(job.status, TrainingJob.SUCCEEDED, job.error)
+            self.assertEqual(job.files_processed, job.files_total)
+            self.assertGreater(job.tokens_counted, 0)
+            self.assertTrue(os.path.isfile(dump_filename))
+
+            response = self.client.get(reverse('training_status', args=[job.id]))
+            self.assertEqual(response.json()['status'], TrainingJob.SUCCEEDED)
+
+
+class TestTrainingProcess(TransactionTestCase):
+    def test_job_succeeds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, 'corpus')
+            os.mkdir(corpus)
+            with open(os.path.join(corpus, '0.txt'), 'w', encoding='utf-8') as output_stream:
+                output_stream.write('в дом и сад, на мост и в лес\nи в сад')
+            dump_filename = os.path.join(directory, 'generator.pickle')
+            job = start_training_job(corpus, 2, dump_filename)
+            self.assertEqual(start_training_job(corpus, 2, dump_filename).id, job.id)
+            for _ in range(600):
+                job.refresh_from_db()
+                if not job.is_active():
+                    break
+                time.sleep(0.1)
+            status = get_job_status(job)
+            self.assertEqual(status['status'], TrainingJob.SUCCEEDED, status['error'])
+            self.assertEqual((status['files_processed'], status['files_total']), (1, 1))
+            self.assertTrue(os.path.isfile(dump_filename))
+
+
+class TestBatchGeneration(TestCase):
+    def test_api(self):
+        response = self.client.get(reverse('api_perashki'), {'n': 3, 'seed': 7, 'engine': 'feasible'})
+        perashki = response.json()['perashki']
+        self.assertEqual(len(perashki), 3)
+        self.assertTrue(all(len(perashok['lines']) == 4 for perashok in perashki))
+        again = self.client.get(reverse('api_perashki'), {'n': 3, 'seed': 7, 'engine': 'feasible'}).json()
+        self.assertEqual([p['lines'] for p in again['perashki']], [p['lines'] for p in perashki])
+        self.assertEqual(self.client.get(reverse('api_perashki'), {'n': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_perashki'), {'model': 'unknown-2'}).status_code, 400)
+
+    def test_workers_give_the_same_poems(self):
+        serial = generate_many(4, seed=1)
+        parallel = generate_many(4, seed=1, workers=2)
+        self.assertEqual([p['text'] for p in parallel], [p['text'] for p in serial])
+
+
+class TestPerashkiPool(unittest.TestCase):
+    def test_refill_and_counters(self):
+        pool = PerashkiPool(size=3, low_water=1)
+        self.assertEqual(len(pool.pop()['text'].split('\n')), 4)
+        for _ in range(100):
+            if pool.get_stats()['available'] == 3:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(pool.pop()['text'].split('\n')), 4)
+        stats = pool.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_disabled(self):
+        pool = PerashkiPool(size=0, low_water=0)
+        pool.pop()
+        self.assertEqual(pool.threads, [])
+        self.assertEqual(pool.get_stats()['misses'], 1)
+
+
+class TestPermalinks(TestCase):
+    def test_same_seed_same_poem(self):
+        response = self.client.post(reverse('generator_index'), {'more': 1})
+        context = response.context
+        url = reverse('perashok_permalink', args=(context['perashok_version'], context['perashok_seed']))
+        permalink = self.client.get(url, {'engine': context['perashok_engine']})
+        self.assertEqual(permalink.context['perashok_lines'], context['perashok_lines'])
+
+        self.client.post(reverse('generator_index'), {'save': 1, 'version': context['perashok_version'],
+                                                      'seed': context['perashok_seed'],
+                                                      'engine': context['perashok_engine']})
+        self.assertEqual(Perashok.objects.get().perashok_text.split('\n'), context['perashok_lines'])
+
+    def test_invalid_save(self):
+        for data in ({}, {'version': '0' * 12}, {'version': '0' * 12, 'seed': 'x'},
+                     {'version': '0' * 12, 'seed': -1}, {'seed': 1}, {'version': 'x', 'seed': 1}):
+            data.update({'save': 1, 'engine': 'retry'})
+            self.assertEqual(self.client.post(reverse('generator_index'), data).status_code, 400)
+        self.assertFalse(Perashok.objects.exists())
+
+    def test_unknown_version(self):
+        self.assertEqual(self.client.get(reverse('perashok_permalink', args=('0' * 12, 1))).status_code, 404)
+
+    def test_permalink_seed_out_of_range(self):
+        version = self.client.post(reverse('generator_index'), {'more': 1}).context['perashok_version']
+        for seed in (2 ** 63, 2 ** 64 + 1):
+            url = reverse('perashok_permalink', args=(version, seed))
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TestInstrumentation(TestCase):
+    def test_metrics(self):
+        generation_stats.reset()
+        generation_stats.enable()
+        try:
+            generator = MarkovChainsGenerator(2)
+            generator.load_dumped(os.path.join(settings.BASE_DIR, 'static', 'generator.pickle'))
+            generator.generate_perashok('retry', random.Random(3))
+        finally:
+            generation_stats.disable()
+        metrics = self.client.get(reverse('metrics')).content.decode('utf-8')
+        self.assertIn('generator_line_seconds_count{engine="retry",syllables="9"} 2', metrics)
+        self.assertIn('generator_line_draws_total{engine="retry",syllables="8"}', metrics)
+        self.assertIn('generator_instrumentation_enabled 0', metrics)
+
+    def test_rhymed_lines_label(self):
+        generation_stats.reset()
+        generation_stats.enable()
+        try:
+            generator = MarkovChainsGenerator(2)
+            generator.load_dumped(os.path.join(settings.BASE_DIR, 'static', 'generator.pickle'))
+            generator.generate_perashok('retry', random.Random(3), rhyme=True)
+        finally:
+            generation_stats.disable()
+        self.assertEqual(generation_stats.lines, Counter({('retry', 9): 2, (RHYMED_ENGINE, 8): 2}))
+
+    def test_toggle_signal(self):
+        # only the WSGI application installs the handler
+        self.assertEqual(signal.getsignal(signal.SIGUSR2), signal.SIG_DFL)
+        self.addCleanup(signal.signal, signal.SIGUSR2, signal.SIG_DFL)
+        self.assertTrue(install_toggle_signal())
+        self.assertEqual(signal.getsignal(signal.SIGUSR2), generation_stats.toggle)
+        def handler(*args):
+            pass
+
+        signal.signal(signal.SIGUSR2, handler)
+        self.assertFalse(install_toggle_signal())
+        self.assertIs(signal.getsignal(signal.SIGUSR2), handler)
+
+
+class TestPruning(unittest.TestCase):
+    def setUp(self):
+        self.frequencies = defaultdict(Counter)
+        self.frequencies[tuple()].update({'суд': 1})
+        self.frequencies[('суд',)].update({'и': 5, 'закон': 3, 'право': 1})
+        self.frequencies[('суд', 'и')].update({'закон': 4, 'право': 1})
+        self.frequencies[('и', 'закон')].update({'и': 1})
+
+    def test_min_count_and_top_k(self):
+        pruned = prune_frequencies(self.frequencies, min_count=2, top_k=1)
+        # single tokens are kept whole, backoff ends with them
+        self.assertEqual(pruned[('суд',)], self.frequencies[('суд',)])
+        self.assertEqual(pruned[('суд', 'и')], Counter({'закон': 4}))
+        self.assertNotIn(('и', 'закон'), pruned)
+        self.assertEqual(pruned[tuple()], Counter({'суд': 1}))
+
+    def test_entropy(self):
+        self.frequencies[('и',)].update({'закон': 8, 'право': 2})
+        pruned = prune_frequencies(self.frequencies, entropy_threshold=1e-3)
+        # the chain predicts the same as its backoff chain
+        self.assertNotIn(('суд', 'и'), pruned)
+        self.assertIn(('суд',), pruned)
+
+    def test_backoff(self):
+        generator = MarkovChainsGenerator(2)
+        generator.frequencies = prune_frequencies(self.frequencies, min_count=2)
+        generator.phonetic_index.cover(['суд', 'и', 'закон', 'право'])
+        self.assertIsNone(generator._make_next_token(True, 0, ['суд', 'и', 'закон']))
+        generator.prune(min_count=2)
+        generator.frequencies[('закон',)].update({'и': 2})
+        self.assertEqual(generator._make_next_token(True, 0, ['суд', 'и', 'закон']), 'и')
+
+    def test_backoff_without_buckets(self):
+        generator = MarkovChainsGenerator(2, bucketed=False)
+        generator.frequencies = self.frequencies
+        generator.phonetic_index.cover(['суд', 'и', 'закон', 'право'])
+        generator.prune(min_count=2)
+        generator.frequencies[('закон',)].update({'и': 2})
+        self.assertEqual(generator._make_next_token(True, 0, ['суд', 'и', 'закон']), 'и')
+
+    def test_memory_budget(self):
+        generator = MarkovChainsGenerator(2)
+        generator.frequencies = self.frequencies
+        generator.phonetic_index.cover(['суд', 'и', 'закон', 'право'])
+        budget = CompactNgramStore.from_frequencies(
+            prune_frequencies(self.frequencies, min_count=2), 2).footprint()
+        self.assertEqual(generator.prune(memory_budget=budget), 2)
+        self.assertEqual(generator.pruning['min_count'], 2)
+        self.assertEqual(generator.frequencies[('суд',)], Counter({'и': 5, 'закон': 3, 'право': 1}))
+        self.assertNotIn(('и', 'закон'), generator.frequencies)
+        # chains of fewer than two tokens are not pruned to fit
+        self.assertRaises(ValueError, MarkovChainsGenerator(2).prune, memory_budget=1)
@@ -5,4 +5,9 @@ from . import views
 urlpatterns = [
     url(r'^$', views.index, name='generator_index'),
     url(r'^gallery$', views.gallery, name='gallery'),
+    url(r'^p/(?P<version>[0-9a-f]+)/(?P<seed>\d+)$', views.perashok_permalink, name='perashok_permalink'),
+    url(r'^api/perashki$', views.api_perashki, name='api_perashki'),
+    url(r'^api/pool$', views.pool_stats, name='pool_stats'),
+    url(r'^metrics$', views.metrics, name='metrics'),
+    url(r'^train/(?P<job_id>\d+)$', views.training_status, name='training_status'),
 ]
@@ -1,31 +1,142 @@
-from django.shortcuts import render
-from .perashki_generator import train_ngram_model, make_random_perashok
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, Http404
+from django.shortcuts import render, get_object_or_404
+from .perashki_generator import generate_many, get_dump_filename, ENGINES
+from .jobs import start_training_job, get_job_status
+from .pool import get_pool, pools
+from .cache import get_seeded_perashok, perashki_cache
+from .instrumentation import generation_stats
+from .registry import get_served_models, registry
 from datetime import datetime
+from os.path import isfile
+import re
+import time
 
-from .models import Perashok
+from .models import Perashok, TrainingJob
+
+def get_perashok_context(text, version, seed, engine):
+    return {
+        'perashok_lines': text.split('\n'),
+        'perashok_version': version,
+        'perashok_seed': seed,
+        'perashok_engine': engine,
+    }
+
+def get_requested_model(params):
+    """
+    :return (name, dump_filename, depth): model chosen in the request parameters,
+    None if it is not one of the served models
+    """
+    models = get_served_models()
+    name = params.get('model', next(iter(models)))
+    if name not in models:
+        return None
+    corpus, depth = models[name]
+    return name, get_dump_filename(corpus, depth), depth
+
+# versions are prefixes of the dump sha1, see ModelRegistry
+VERSION_PATTERN = re.compile(r'^[0-9a-f]+$')
+
+NOT_TRAINED_MESSAGE = "Тесто для этой начинки ещё не замешано, замесите его и подождите, пока оно подойдёт"
 
 def index(request):
-    context = {}
+    model_name, dump_filename, depth = get_requested_model(request.POST) or get_requested_model({})
+    context = {'models': list(get_served_models()), 'model': model_name}
     if "train" in request.POST:
-        train_ngram_model()
-        context['info_message'] = "Теперь можно печь пирожки!"
+        job = start_training_job(*get_served_models()[model_name])
+        context['training_job'] = job
+        context['info_message'] = "Тесто замешивается, пирожки будут печься по новому рецепту, как только оно подойдёт"
     elif "more" in request.POST:
-        generated_text = make_random_perashok()
-        context['perashok_lines'] = generated_text.split('\n')
-        context['perashok_text'] = generated_text
+        if not isfile(dump_filename):
+            context['info_message'] = NOT_TRAINED_MESSAGE
+            return render(request, 'index.html', context)
+        perashok = get_pool(dump_filename, depth).pop()
+        context.update(get_perashok_context(perashok['text'], perashok['version'], perashok['seed'], perashok['engine']))
     elif "save" in request.POST:
-        text = request.POST['hidden_text']
-        
-        perashok = Perashok(perashok_text=text, adding_date=datetime.now())
+        version = request.POST.get('version', '')
+        engine = request.POST.get('engine', '')
+        try:
+            seed = int(request.POST['seed'])
+        except (KeyError, ValueError):
+            seed = -1
+        if not 0 <= seed < 2 ** 63:
+            return HttpResponseBadRequest("seed must be a non-negative 64-bit integer")
+        if not VERSION_PATTERN.match(version):
+            return HttpResponseBadRequest("version must be a model version")
+        text = None
+        if engine in ENGINES and isfile(dump_filename):
+            text = get_seeded_perashok(version, engine, seed, dump_filename, depth)
+        if text is None:
+            context['info_message'] = "Этот пирожок испечён по старому рецепту, его уже не повторить"
+            return render(request, 'index.html', context)
+
+        perashok = Perashok(perashok_text=text, adding_date=datetime.now(),
+                            seed=seed, model_version=version, engine=engine)
         perashok.save()
         
-        context['perashok_lines'] = text.split('\n')
-        context['perashok_text'] = text
+        context.update(get_perashok_context(text, version, seed, engine))
         context['info_message'] = "Трям! Пирожок успешно добавлен в галерею, потомки вас не забудут"
         
     return render(request, 'index.html', context)
 
+def perashok_permalink(request, version, seed):
+    seed = int(seed)
+    if not 0 <= seed < 2 ** 63:
+        raise Http404("Perashok not found")
+    engine = request.GET.get('engine', 'retry')
+    model = get_requested_model(request.GET)
+    text = None
+    if engine in ENGINES and model is not None and isfile(model[1]):
+        text = get_seeded_perashok(version, engine, seed, model[1], model[2])
+    if text is None:
+        raise Http404("Perashok not found")
+    context = get_perashok_context(text, version, seed, engine)
+    context.update({'models': list(get_served_models()), 'model': model[0]})
+    return render(request, 'index.html', context)
+
 def gallery(request):
     perashki = [[p.perashok_text.split('\n'), p.adding_date] for p in Perashok.objects.all()]
     context = {"perashki_list": perashki}
     return render(request, 'gallery.html', context)
+
+def training_status(request, job_id):
+    job = get_object_or_404(TrainingJob, id=job_id)
+    return JsonResponse(get_job_status(job))
+
+def api_perashki(request):
+    try:
+        n = int(request.GET.get('n', 1))
+        seed = int(request.GET['seed']) if 'seed' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'n and seed must be integers'}, status=400)
+    engine = request.GET.get('engine', 'retry')
+    if not 0 < n <= settings.GENERATOR_BATCH_MAX:
+        return JsonResponse({'error': 'n must be between 1 and {}'.format(settings.GENERATOR_BATCH_MAX)}, status=400)
+    if engine not in ENGINES:
+        return JsonResponse({'error': 'engine must be one of {}'.format(', '.join(ENGINES))}, status=400)
+    model = get_requested_model(request.GET)
+    if model is None:
+        return JsonResponse({'error': 'model must be one of {}'.format(', '.join(get_served_models()))},
+                            status=400)
+    model_name, dump_filename, depth = model
+    if not isfile(dump_filename):
+        return JsonResponse({'error': 'model {} is not trained'.format(model_name)}, status=404)
+
+    started = time.perf_counter()
+    # a process pool costs more than a batch and would fork the threaded server
+    perashki = generate_many(n, seed, 1, engine, dump_filename, depth)
+    return JsonResponse({
+        'model': model_name,
+        'perashki': [{'seed': perashok['seed'],
+                      'lines': perashok['text'].split('\n'),
+                      'generation_ms': perashok['seconds'] * 1e3} for perashok in perashki],
+        'total_ms': (time.perf_counter() - started) * 1e3,
+    }, json_dumps_params={'ensure_ascii': False})
+
+def pool_stats(request):
+    return JsonResponse({'pools': [pool.get_stats() for pool in list(pools.values())],
+                         'cache': perashki_cache.get_stats(),
+                         'registry': registry.get_stats()})
+
+def metrics(request):
+    return HttpResponse(generation_stats.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,104 @@
+"""
+Streaming corpus reader shared by the generator and stats apps.
+
+Files are read line by line through large buffers, so memory stays bounded by
+the longest line whatever the corpus size. Tokenizing patterns are compiled
+once. A file can also be split into byte ranges on line boundaries, so that
+parallel consumers read their own parts of the file instead of receiving
+lines from the parent process.
+"""
+import os
+import re
+from collections import deque
+from itertools import chain, islice
+from os import listdir
+from os.path import isfile, join
+
+READ_BUFFER_SIZE = 1 << 20
+
+TOKEN_PATTERN = re.compile(r"[^\W\d]+|[^\w\s]+|\s+|\d+")
+# runs of cyrillic words separated by spaces and hyphens, punctuation ends a fragment
+FRAGMENT_PATTERN = re.compile(r"[а-яА-Я][а-яА-Я\-\s]*")
+
+
+def list_corpus_files(directory):
+    return [join(directory, f) for f in listdir(directory) if isfile(join(directory, f))]
+
+
+def read_lines(filename, skip_head=0, skip_tail=0, buffer_size=READ_BUFFER_SIZE):
+    """
+    Lazily reads the lines of a utf-8 file.
+    :param skip_head: number of lines to skip at the start of the file
+    :param skip_tail: number of lines to skip at the end of the file
+    """
+    with open(filename, encoding='utf-8', buffering=buffer_size) as input_stream:
+        lines = islice(input_stream, skip_head, None)
+        if not skip_tail:
+            yield from lines
+            return
+        window = deque(islice(lines, skip_tail))
+        for line in lines:
+            window.append(line)
+            yield window.popleft()
+
+
+def split_byte_ranges(filename, chunk_size):
+    """
+    :return ranges: (start, end) byte offsets of consecutive parts of the file
+    of about chunk_size bytes, each starting at the beginning of a line
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, 'rb') as input_stream:
+        start = 0
+        while start < size:
+            input_stream.seek(min(start + chunk_size, size))
+            if input_stream.tell() < size:
+                input_stream.readline()
+            end = input_stream.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_range_lines(filename, start, end, buffer_size=READ_BUFFER_SIZE):
+    """
+    Lazily reads the lines of a utf-8 file that start in the byte range [start, end).
+    """
+    with open(filename, 'rb', buffering=buffer_size) as input_stream:
+        input_stream.seek(start)
+        position = start
+        while position < end:
+            line = input_stream.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+
+def read_line_chunks(filenames, chunk_lines):
+    """
+    Lists of at most chunk_lines lines of the files, read in order.
+    """
+    for filename in filenames:
+        lines = read_lines(filename)
+        for chunk in iter(lambda: list(islice(lines, chunk_lines)), []):
+            yield chunk
+
+
+def tokenize(line):
+    return [token.lower() for token in TOKEN_PATTERN.findall(line)]
+
+
+def tokenize_without_punctuation(line):
+    for token in FRAGMENT_PATTERN.findall(line):
+        yield chain(*([t.split('-') for t in token.strip().lower().split()]))
+
+
+def read_fragments(lines):
+    """
+    Token lists of the punctuation-free fragments of the lines.
+    """
+    for line in lines:
+        for tokens in tokenize_without_punctuation(line.strip()):
+            yield list(tokens)
@@ -0,0 +1,63 @@
+"""
+Lazily created process-wide resources.
+
+Heavy linguistic resources, like the accent dictionary, the accent classifiers
+and the morphological analyzer, are created on first use instead of at import,
+so processes that never touch them start quickly. Each resource is created once
+per process, even when several threads ask for it at the same time.
+"""
+import threading
+import time
+
+# name -> LazyResource of every resource declared in the process, for the startup report
+resources = {}
+resources_lock = threading.Lock()
+
+
+class LazyResource:
+    def __init__(self, name, factory):
+        """
+        :param factory: callable without arguments creating the resource
+        """
+        self.name = name
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+        self.load_seconds = None
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    started = time.perf_counter()
+                    self.value = self.factory()
+                    self.load_seconds = time.perf_counter() - started
+                    self.loaded = True
+        return self.value
+
+    def reset(self):
+        with self.lock:
+            self.value = None
+            self.loaded = False
+            self.load_seconds = None
+
+
+def lazy_resource(name, factory):
+    """
+    :return resource: the LazyResource declared under the name, a new one created
+    by factory if there is none yet
+    """
+    with resources_lock:
+        resource = resources.get(name)
+        if resource is None:
+            resource = LazyResource(name, factory)
+            resources[name] = resource
+        return resource
+
+
+def get_resources_report():
+    with resources_lock:
+        declared = sorted(resources.items())
+    return {name: {'loaded': resource.loaded, 'load_seconds': resource.load_seconds}
+            for name, resource in declared}
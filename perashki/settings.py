@@ -80,6 +80,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file rather than the in-memory default, so that spawned training processes reach it
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
     }
 }
 
@@ -126,3 +128,53 @@ PERASHKI_TAGGED_DIR = os.path.join(BASE_DIR, 'static', 'perashki_tagged')
 PERASHKI_UNTAGGED_DIR = os.path.join(BASE_DIR, 'static', 'perashki')
 
 ALLOWED_POS_TAGS = ["NOUN", "ADJF", "ADJS", "COMP", "VERB", "INFN", "PRTF", "PRTS", "GRND", "NUMR", "ADVB", "NPRO", "PRED", "PREP", "CONJ", "PRCL", "INTJ"]
+
+# number of processes counting n-grams when the generator is trained
+GENERATOR_TRAINING_WORKERS = 1
+
+# largest batch of the batch generation API, generated on the request thread
+GENERATOR_BATCH_MAX = 1000
+
+# pool of ready perashki served by the "more" button: size, level at which
+# background refilling starts and number of refilling threads, size 0 disables it
+GENERATOR_POOL_SIZE = 20
+GENERATOR_POOL_LOW_WATER = 5
+GENERATOR_POOL_REFILL_THREADS = 1
+
+# number of generated perashki kept for permalinks
+GENERATOR_CACHE_SIZE = 10000
+
+# count draws, backtracks and restarts of generated lines from startup,
+# SIGUSR2 toggles the counting in a running worker unless GENERATOR_INSTRUMENTATION_SIGNAL
+# is off or the server already handles SIGUSR2
+GENERATOR_INSTRUMENTATION = False
+GENERATOR_INSTRUMENTATION_SIGNAL = True
+
+# (corpus folder under static, depth) of the models that can be chosen, the first one
+# is the default; the loaded models are evicted least recently used first once they
+# take more than GENERATOR_MODELS_MEMORY bytes, None for no limit
+GENERATOR_MODELS = [('constitution', 2), ('constitution', 3)]
+GENERATOR_MODELS_MEMORY = 512 * 1024 * 1024
+
+# count pruning of the models of a given depth, keyword arguments of
+# MarkovChainsGenerator.prune; pruned models back off to shorter chains. Chains of fewer
+# than two tokens are never pruned, the budget must exceed the unpruned depth-2 model
+# (1.16 MB for the constitution corpus)
+GENERATOR_PRUNING = {
+    3: {'entropy_threshold': 1e-5, 'memory_budget': 2 * 1024 * 1024},
+    4: {'entropy_threshold': 1e-5, 'memory_budget': 2 * 1024 * 1024},
+}
+
+# train models into memory-mapped binary dumps (.bin) and serve them from there instead of
+# pickles, so all the worker processes share the pages of one model; convert_to_binary
+# turns an existing pickle into a binary dump. The 'feasible' engine and rhymes add private
+# arrays per process on top of the shared store: about 0.9 MB of transitions per model and
+# 0.07 MB per line length for the constitution model of depth 2, next to its 1.1 MB store
+GENERATOR_BINARY_MODELS = False
+
+# count n-grams with NumPy instead of the token-by-token trainer, the counts are the same
+GENERATOR_TRAINING_VECTORIZED = True
+
+# format of the default accent dictionary: 'trie' loads the datrie dump into every
+# process, 'compact' memory-maps the packed format read-only, so processes share it
+PHONETICS_ACCENTS_FORMAT = 'trie'
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "perashki.settings")
 
 application = get_wsgi_application()
+
+# only the serving process listens for the instrumentation toggle,
+# management commands, tests and training processes keep their signal handlers
+from generator.instrumentation import install_toggle_signal
+install_toggle_signal()
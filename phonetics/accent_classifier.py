@@ -4,6 +4,8 @@
 
 import gc
 import os
+from collections import defaultdict
+from functools import partial
 
 import numpy as np
 from sklearn.tree import DecisionTreeClassifier
@@ -13,6 +15,41 @@ from sklearn.model_selection import ShuffleSplit, cross_val_score
 from .preprocess import CYRRILIC_LOWER_CONSONANTS, CYRRILIC_LOWER_VOWELS, VOWELS
 from .phonetics import Phonetics
 from .preprocess import get_first_vowel_position
+from perashki.resources import lazy_resource
+
+# Буквы, число которых в слоге - признаки классификатора, в порядке признаков.
+FEATURE_LETTERS = CYRRILIC_LOWER_CONSONANTS + CYRRILIC_LOWER_VOWELS
+# Признаки слога: кончается ли он на гласную, его длина и число каждой из букв.
+SYLLABLE_FEATURES = 2 + len(FEATURE_LETTERS)
+
+
+def make_letters_table(letters):
+    """
+    :return table: массив, отображающий код символа в номер буквы в letters, -1 для прочих символов
+    """
+    table = np.full(max(map(ord, letters)) + 1, -1, dtype=np.int64)
+    for index, letter in enumerate(letters):
+        table[ord(letter)] = index
+    return table
+
+
+FEATURE_LETTERS_TABLE = make_letters_table(FEATURE_LETTERS)
+VOWELS_TABLE = make_letters_table(VOWELS)
+
+
+def lookup_codes(table, codes):
+    return np.where(codes < len(table), table[np.minimum(codes, len(table) - 1)], -1)
+
+
+def get_classifier_resource(model_dir, syllables_number):
+    """
+    Классификатор слов с заданным числом слогов, общий для процесса и загружаемый при первом обращении.
+    :param model_dir: папка с классификаторами.
+    :param syllables_number: число слогов.
+    :return resource: LazyResource классификатора.
+    """
+    filename = os.path.join(os.path.abspath(model_dir), "clf_" + str(syllables_number) + ".pickle")
+    return lazy_resource('accent_classifier:' + filename, partial(joblib.load, filename))
 
 
 class AccentClassifier:
@@ -20,10 +57,11 @@ class AccentClassifier:
     def __init__(self, model_dir, accents_dict):
         if not os.path.isfile(os.path.join(model_dir, "clf_2.pickle")):
             self.build_accent_classifiers(model_dir, accents_dict)
-        self.classifiers = {l: joblib.load(
-            os.path.join(model_dir, "clf_" + str(l) + ".pickle")) for l in range(2, 13)}
+        # Классификаторы загружаются при первом слове с их числом слогов.
+        self.classifiers = {l: get_classifier_resource(model_dir, l) for l in range(2, 13)}
 
-    def generate_sample(self, syllables):
+    @staticmethod
+    def generate_sample(syllables):
         l = len(syllables)
         features = []
         for i in range(0, l):
@@ -34,12 +72,35 @@ class AccentClassifier:
                 features.append(sum([ch1 == ch2 for ch2 in text]))
         return features
 
+    @staticmethod
+    def generate_samples(syllables_list):
+        """
+        Признаки набора слов с одинаковым числом слогов за один проход: все слоги
+        кодируются одним массивом кодов символов, из которого считается матрица числа букв.
+        :param syllables_list: массив слогов каждого слова.
+        :return features: матрица признаков, строка на слово, как у generate_sample.
+        """
+        l = len(syllables_list[0]) if syllables_list else 0
+        texts = [syllable.text for syllables in syllables_list for syllable in syllables]
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        columns = lookup_codes(FEATURE_LETTERS_TABLE, codes)
+        known = columns >= 0
+
+        features = np.zeros((len(texts), SYLLABLE_FEATURES), dtype=np.int64)
+        np.add.at(features, (rows[known], columns[known] + 2), 1)
+        features[:, 1] = lengths
+        if len(texts):
+            features[:, 0] = lookup_codes(VOWELS_TABLE, codes[np.cumsum(lengths) - 1]) >= 0
+        return features.reshape(len(syllables_list), l * SYLLABLE_FEATURES)
+
     def build_accent_classifiers(self, model_dir, accents_dict):
         if not os.path.exists(model_dir):
             os.mkdir(model_dir)
         train_syllables = {k: [] for k in range(2, 13)}
         answers = {k: [] for k in range(2, 13)}
-        for key, accents in accents_dict.data.items():
+        for key, accents in accents_dict.items():
             syllables = Phonetics.get_word_syllables(key)
             if len(syllables) >= 2:
                 for syllable in syllables:
@@ -52,9 +113,7 @@ class AccentClassifier:
                                 train_syllables[len(syllables)].append(syllables)
 
         for l in range(2, 13):
-            train_data = []
-            for syllables in train_syllables[l]:
-                train_data.append(self.generate_sample(syllables))
+            train_data = self.generate_samples(train_syllables[l])
             clf = DecisionTreeClassifier()
             clf.fit(train_data, answers[l])
             joblib.dump(clf, os.path.join(model_dir, "clf_" + str(l) + ".pickle"))
@@ -68,7 +127,24 @@ class AccentClassifier:
             gc.collect()
 
     def classify_accent(self, word):
-        syllables = Phonetics.get_word_syllables(word)
-        answer = self.classifiers[len(syllables)].predict(np.array(self.generate_sample(syllables)).reshape(1, -1))
-        syllable = syllables[answer[0]]
-        return get_first_vowel_position(syllable.text) + syllable.begin
+        return self.classify_accents([word])[0]
+
+    def classify_accents(self, words):
+        """
+        Расстановка ударений в наборе слов: слова группируются по числу слогов,
+        и классификатор каждой группы вызывается один раз.
+        :param words: слова.
+        :return accents: позиции ударных букв в словах, в порядке слов.
+        """
+        syllables_list = [Phonetics.get_word_syllables(word) for word in words]
+        groups = defaultdict(list)
+        for index, syllables in enumerate(syllables_list):
+            groups[len(syllables)].append(index)
+        accents = [None] * len(words)
+        for l, indices in groups.items():
+            samples = self.generate_samples([syllables_list[index] for index in indices])
+            answers = self.classifiers[l].get().predict(samples)
+            for index, answer in zip(indices, answers):
+                syllable = syllables_list[index][answer]
+                accents[index] = get_first_vowel_position(syllable.text) + syllable.begin
+        return accents
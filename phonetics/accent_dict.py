@@ -3,10 +3,101 @@
 # Описание: Класс для удобной работы со словарём ударений.
 
 import os
+import threading
+from collections import OrderedDict
+
 import datrie
 
 from .preprocess import CYRRILIC_LOWER_VOWELS, CYRRILIC_LOWER_CONSONANTS
 
+# Число слов, ударения которых помнит кэш одного словаря.
+ACCENT_CACHE_SIZE = 100000
+
+
+def parse_accented_word(word):
+    """
+    Разбор слова со знаками ударения из исходного словаря.
+    :param word: слово, в котором за ударной гласной идёт ' или `.
+    :return (clean_word, accents): слово без знаков и позиции ударений.
+    """
+    pos = 0
+    accents = []
+    letters = []
+    for letter in word:
+        if letter == "'" or letter == "`":
+            pos -= 1
+            accents.append(pos)
+            continue
+        if letter == "ё":
+            accents.append(pos)
+        letters.append(letter)
+        pos += 1
+    return ''.join(letters), accents
+
+
+def parse_accents_lines(lines):
+    """
+    Разбор строк исходного словаря вида "слово#фо'рма1,фо'рма2".
+    :return words: словарь слово -> множество ударений.
+    """
+    words = {}
+    for line in lines:
+        for word in line.split("#")[1].split(","):
+            clean_word, accents = parse_accented_word(word.strip())
+            words.setdefault(clean_word, set()).update(accents)
+    return words
+
+
+class AccentCache:
+    """
+    Потокобезопасный LRU-кэш найденных ударений слов со статистикой попаданий.
+    """
+    def __init__(self, size=ACCENT_CACHE_SIZE):
+        self.size = size
+        self.accents = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, word):
+        """
+        :param word: слово.
+        :return accents: кортеж ударений слова, None, если слова нет в кэше.
+        """
+        with self.lock:
+            accents = self.accents.get(word)
+            if accents is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.accents.move_to_end(word)
+            return accents
+
+    def put(self, word, accents):
+        if not self.size:
+            return
+        with self.lock:
+            self.accents[word] = accents
+            self.accents.move_to_end(word)
+            while len(self.accents) > self.size:
+                self.accents.popitem(last=False)
+
+    def clear(self):
+        """
+        Сброс кэша, когда меняется словарь.
+        """
+        with self.lock:
+            if self.accents:
+                self.accents = OrderedDict()
+                self.invalidations += 1
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'size': self.size, 'cached': len(self.accents), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.0, 'invalidations': self.invalidations}
+
 
 class AccentDict:
     """
@@ -14,6 +105,8 @@ class AccentDict:
     """
     def __init__(self, accents_filename):
         self.data = datrie.Trie(CYRRILIC_LOWER_VOWELS+CYRRILIC_LOWER_CONSONANTS+"-")
+        # Ударения, уже найденные Phonetics.get_word_accent по этому словарю.
+        self.accent_cache = AccentCache()
         self.load(accents_filename)
 
     def load(self, filename):
@@ -23,27 +116,13 @@ class AccentDict:
         """
         dump_file = filename + '.trie'
 
+        self.accent_cache.clear()
         if os.path.isfile(dump_file):
             self.data = datrie.Trie.load(dump_file)
         else:
             with open(filename+".txt", 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                for line in lines:
-                    for word in line.split("#")[1].split(","):
-                        word = word.strip()
-                        pos = 0
-                        accents = []
-                        clean_word = ""
-                        for i in range(len(word)):
-                            if word[i] == "'" or word[i] == "`":
-                                pos -= 1
-                                accents.append(pos)
-                                continue
-                            if word[i] == "ё":
-                                accents.append(pos)
-                            clean_word += word[i]
-                            pos += 1
-                        self.update(clean_word, accents)
+                for word, accents in parse_accents_lines(f).items():
+                    self.update(word, accents)
             self.data.save(dump_file)
 
     def save(self, filename):
@@ -60,12 +139,51 @@ class AccentDict:
             return list(self.data[word])
         return []
 
+    def items(self):
+        """
+        :return items: пары (слово, множество ударений).
+        """
+        return self.data.items()
+
+    def get_yo_forms(self, word):
+        """
+        Поиск форм слова, в которых любая 'е' может быть записана как 'ё', за один обход дерева.
+        Ветвление происходит только там, где в дереве есть оба продолжения.
+        :param word: слово, которое мы хотим посмотреть в словаре.
+        :return forms: массив пар (форма, ударения) для форм с ударениями, в порядке перебора
+        вариантов: на каждой позиции сначала 'ё', потом 'е'.
+        """
+        forms = []
+
+        def walk(state, position):
+            while position < len(word) and word[position] != 'е':
+                if not state.walk(word[position]):
+                    return
+                position += 1
+            if position == len(word):
+                if state.is_terminal() and state.data():
+                    forms.append((''.join(letters), list(state.data())))
+                return
+            yo_state = datrie.State(self.data)
+            state.copy_to(yo_state)
+            if yo_state.walk('ё'):
+                letters[position] = 'ё'
+                walk(yo_state, position + 1)
+                letters[position] = 'е'
+            if state.walk('е'):
+                walk(state, position + 1)
+
+        letters = list(word)
+        walk(datrie.State(self.data), 0)
+        return forms
+
     def update(self, word, accents):
         """
         Обновление словаря.
         :param word: слово.
         :param accents: набор ударений.
         """
+        self.accent_cache.clear()
         if word not in self.data:
             self.data[word] = set(accents)
         else:
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Описание: Компактный формат словаря ударений, отображаемый в память только для чтения.
+
+"""
+Формат файла, все целые числа little-endian:
+
+    заголовок       сигнатура, версия формата, число слов, число ячеек хэш-таблицы,
+                    размер данных и их crc32, число групп 'ё' и ячеек их хэш-таблицы
+    offsets         'I' на каждое слово + 1, границы слов в words
+    accent_offsets  'I' на каждое слово + 1, границы ударений слова в accents
+    buckets         'I' хэш-таблица с линейным пробированием по crc32 слова:
+                    номер слова + 1, 0 для пустой ячейки
+    yo_buckets      'I' такая же хэш-таблица групп 'ё' по crc32 слова, где 'ё' записаны как 'е':
+                    номер группы + 1
+    yo_offsets      'I' на каждую группу + 1, границы группы в yo_members
+    yo_members      'I' номера слов группы в порядке перебора get_yo_forms
+    accents         'h' позиции ударений каждого слова по возрастанию
+    words           слова в utf-8, отсортированные по байтам
+
+Группа 'ё' - все слова, совпадающие после замены 'ё' на 'е', если среди них есть слово с 'ё'.
+Слова и группы ищутся по хэш-таблицам, префиксы - двоичным поиском, прямо в отображении
+файла, поэтому все процессы, открывшие один файл, делят его страницы,
+а загрузка не разбирает словарь.
+"""
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
+
+from perashki.corpus import read_range_lines, split_byte_ranges
+
+from .accent_dict import AccentCache, parse_accents_lines
+
+MAGIC = b'PKAD'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHIIQIII')
+# Размер заголовка с выравниванием, чтобы массивы 'I' начинались с границы слова.
+HEADER_SIZE = 48
+# Размер части исходного словаря, которую разбирает один процесс сборки.
+BUILD_CHUNK_SIZE = 1 << 18
+E_BYTES, YO_BYTES = 'е'.encode('utf-8'), 'ё'.encode('utf-8')
+
+
+class AccentStoreError(ValueError):
+    pass
+
+
+def parse_accents_range(filename, byte_range):
+    return parse_accents_lines(read_range_lines(filename, *byte_range))
+
+
+def build_hash_table(keys):
+    """
+    :param keys: ключи в порядке номеров.
+    :return buckets: хэш-таблица с линейным пробированием по crc32 ключа, номер ключа + 1 в ячейке.
+    """
+    # не больше половины ячеек заняты, чтобы цепочки проб были короткими
+    buckets_number = 1
+    while buckets_number < 2 * len(keys):
+        buckets_number *= 2
+    buckets = array('I', bytes(4 * buckets_number))
+    for index, key in enumerate(keys):
+        bucket = zlib.crc32(key) & (buckets_number - 1)
+        while buckets[bucket]:
+            bucket = (bucket + 1) & (buckets_number - 1)
+        buckets[bucket] = index + 1
+    return buckets
+
+
+def write_accent_store(filename, words):
+    """
+    Запись словаря в компактном формате.
+    :param words: словарь слово -> набор ударений.
+    """
+    if sys.byteorder != 'little':
+        raise AccentStoreError("словарь ударений можно записать только на little-endian машине")
+    offsets, accent_offsets, accents = array('I', [0]), array('I', [0]), array('h')
+    encoded = bytearray()
+    keys = []
+    for key, word_accents in sorted((word.encode('utf-8'), sorted(set(word_accents)))
+                                    for word, word_accents in words.items()):
+        keys.append(key)
+        encoded += key
+        offsets.append(len(encoded))
+        accents.extend(word_accents)
+        accent_offsets.append(len(accents))
+    buckets = build_hash_table(keys)
+
+    yo_keys = {key.replace(YO_BYTES, E_BYTES) for key in keys if YO_BYTES in key}
+    groups = defaultdict(list)
+    for index, key in enumerate(keys):
+        if key.replace(YO_BYTES, E_BYTES) in yo_keys:
+            groups[key.replace(YO_BYTES, E_BYTES)].append(index)
+    yo_offsets, yo_members = array('I', [0]), array('I')
+    for members in groups.values():
+        # в первой различающейся позиции 'ё' идёт раньше 'е'
+        yo_members.extend(sorted(members, key=lambda index: keys[index].replace(YO_BYTES, b'\0\0')))
+        yo_offsets.append(len(yo_members))
+    yo_buckets = build_hash_table(list(groups))
+
+    body = offsets.tobytes() + accent_offsets.tobytes() + buckets.tobytes() + yo_buckets.tobytes() + \
+        yo_offsets.tobytes() + yo_members.tobytes() + accents.tobytes() + bytes(encoded)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(words), len(buckets), len(body), zlib.crc32(body),
+                         len(groups), len(yo_buckets))
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as store_file:
+        store_file.write(header.ljust(HEADER_SIZE, b'\0'))
+        store_file.write(body)
+    os.replace(temporary_filename, filename)
+
+
+def read_format_version(filename):
+    """
+    :return version: версия формата компактного словаря, None, если это не словарь ударений.
+    """
+    with open(filename, 'rb') as store_file:
+        header = store_file.read(HEADER_SIZE)
+    if len(header) < 6 or header[:4] != MAGIC:
+        return None
+    return struct.unpack_from('<H', header, 4)[0]
+
+
+def build_accent_store(source_filename, target_filename, workers=1, chunk_size=BUILD_CHUNK_SIZE):
+    """
+    Потоковая сборка компактного словаря из исходного текстового словаря.
+    Файл делится на части по границам строк, каждую часть читает и разбирает свой процесс.
+    :param workers: число процессов.
+    :return words: число слов в словаре.
+    """
+    ranges = split_byte_ranges(source_filename, chunk_size)
+    parse = partial(parse_accents_range, source_filename)
+    words = {}
+
+    def merge(part):
+        for word, accents in part.items():
+            words.setdefault(word, set()).update(accents)
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            for part in pool.imap_unordered(parse, ranges):
+                merge(part)
+    else:
+        for byte_range in ranges:
+            merge(parse(byte_range))
+    write_accent_store(target_filename, words)
+    return len(words)
+
+
+class CompactAccentDict:
+    """
+    Словарь ударений в компактном формате с тем же интерфейсом чтения, что у AccentDict.
+    """
+    def __init__(self, accents_filename, workers=1):
+        """
+        :param accents_filename: имя словаря без расширения, компактный словарь
+        собирается из .txt файла, если его ещё нет или он записан в старой версии формата.
+        """
+        store_file = accents_filename + '.accents'
+        if not os.path.isfile(store_file) or read_format_version(store_file) in range(1, FORMAT_VERSION):
+            build_accent_store(accents_filename + '.txt', store_file, workers)
+        self.accent_cache = AccentCache()
+        self.load(store_file)
+
+    def load(self, filename, verify=True):
+        """
+        Отображение компактного словаря в память.
+        :param verify: сверить контрольную сумму, при этом файл читается целиком один раз.
+        """
+        with open(filename, 'rb') as store_file:
+            mapping = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapping)
+        if len(buffer) < HEADER_SIZE:
+            raise AccentStoreError("{} слишком короткий для словаря ударений".format(filename))
+        if buffer[:4] != MAGIC:
+            raise AccentStoreError("{} не является словарём ударений".format(filename))
+        version = struct.unpack_from('<H', buffer, 4)[0]
+        if version != FORMAT_VERSION:
+            raise AccentStoreError("неподдерживаемая версия формата словаря {}".format(version))
+        _, _, size, buckets_number, body_size, checksum, groups_number, yo_buckets_number = \
+            HEADER.unpack_from(buffer, 0)
+        if HEADER_SIZE + body_size != len(buffer):
+            raise AccentStoreError("{} обрезан".format(filename))
+        if verify and zlib.crc32(buffer[HEADER_SIZE:]) != checksum:
+            raise AccentStoreError("контрольная сумма {} не совпадает".format(filename))
+
+        self.accent_cache.clear()
+        self.size = size
+        position = HEADER_SIZE
+        self.offsets = buffer[position:position + 4 * (size + 1)].cast('I')
+        position += 4 * (size + 1)
+        self.accent_offsets = buffer[position:position + 4 * (size + 1)].cast('I')
+        position += 4 * (size + 1)
+        self.buckets = buffer[position:position + 4 * buckets_number].cast('I')
+        position += 4 * buckets_number
+        self.yo_buckets = buffer[position:position + 4 * yo_buckets_number].cast('I')
+        position += 4 * yo_buckets_number
+        self.yo_offsets = buffer[position:position + 4 * (groups_number + 1)].cast('I')
+        position += 4 * (groups_number + 1)
+        self.yo_members = buffer[position:position + 4 * self.yo_offsets[groups_number]].cast('I')
+        position += 4 * self.yo_offsets[groups_number]
+        self.accents = buffer[position:position + 2 * self.accent_offsets[size]].cast('h')
+        position += 2 * self.accent_offsets[size]
+        # слова читаются срезами самого отображения, они сразу дают bytes
+        self.mapping = mapping
+        self.words_position = position
+
+    def __len__(self):
+        return self.size
+
+    def _key(self, index):
+        position = self.words_position
+        return self.mapping[position + self.offsets[index]:position + self.offsets[index + 1]]
+
+    def _group_key(self, group):
+        return self._key(self.yo_members[self.yo_offsets[group]]).replace(YO_BYTES, E_BYTES)
+
+    @staticmethod
+    def _probe(buckets, key, get_key):
+        mask = len(buckets) - 1
+        bucket = zlib.crc32(key) & mask
+        while buckets[bucket]:
+            index = buckets[bucket] - 1
+            if get_key(index) == key:
+                return index
+            bucket = (bucket + 1) & mask
+        return None
+
+    def _find(self, key):
+        return self._probe(self.buckets, key, self._key)
+
+    def _get_accents(self, index):
+        return list(self.accents[self.accent_offsets[index]:self.accent_offsets[index + 1]])
+
+    def __contains__(self, word):
+        return self._find(word.encode('utf-8')) is not None
+
+    def get_accents(self, word):
+        """
+        :param word: слово, которое мы хотим посмотреть в словаре.
+        :return forms: массив ударений слова, пустой, если слова нет.
+        """
+        index = self._find(word.encode('utf-8'))
+        if index is None:
+            return []
+        return self._get_accents(index)
+
+    def get_yo_forms(self, word):
+        """
+        Поиск форм слова, в которых любая 'е' может быть записана как 'ё', по группе 'ё' слова.
+        :param word: слово, которое мы хотим посмотреть в словаре.
+        :return forms: массив пар (форма, ударения) для форм с ударениями, в порядке перебора
+        вариантов: на каждой позиции сначала 'ё', потом 'е'.
+        """
+        key = word.replace('ё', 'е').encode('utf-8')
+        group = self._probe(self.yo_buckets, key, self._group_key)
+        if group is None:
+            # Без группы единственная возможная форма - само слово.
+            index = self._find(word.encode('utf-8'))
+            members = [] if index is None else [index]
+        else:
+            members = self.yo_members[self.yo_offsets[group]:self.yo_offsets[group + 1]]
+        # 'ё' самого слова остаются 'ё' во всех формах
+        yo_positions = [position for position, letter in enumerate(word) if letter == 'ё']
+        forms = []
+        for index in members:
+            accents = self._get_accents(index)
+            form = self._key(index).decode('utf-8')
+            if accents and all(form[position] == 'ё' for position in yo_positions):
+                forms.append((form, accents))
+        return forms
+
+    def items(self):
+        """
+        :return items: пары (слово, множество ударений) в порядке слов.
+        """
+        for index in range(self.size):
+            yield self._key(index).decode('utf-8'), set(self._get_accents(index))
@@ -6,9 +6,34 @@ from .phonetics_markup import Syllable, Word, Markup, Line
 from .preprocess import count_vowels, get_first_vowel_position, \
     VOWELS, CLOSED_SYLLABLE_CHARS
 from .accent_dict import AccentDict
+from .accent_store import CompactAccentDict
 
 import os
 from django.conf import settings
+from perashki.resources import lazy_resource
+
+
+def load_accents_dict(accents_filename, accents_format=settings.PHONETICS_ACCENTS_FORMAT):
+    """
+    Загрузка словаря ударений в выбранном формате.
+    :param accents_filename: имя словаря без расширения
+    :param accents_format: 'trie' для AccentDict, 'compact' для CompactAccentDict
+    :return accents_dict: словарь ударений
+    """
+    if accents_format == 'compact':
+        return CompactAccentDict(accents_filename)
+    return AccentDict(accents_filename)
+
+
+# Общий словарь по умолчанию, чтобы у всех вызовов был один кэш ударений.
+# Загружается при первом обращении, а не при импорте модуля.
+default_accents_dict = lazy_resource(
+    'accents_dict', lambda: load_accents_dict(os.path.join(settings.BASE_DIR, "static", "dicts", "accents_dict")))
+
+
+def get_default_accents_dict():
+    return default_accents_dict.get()
+
 
 class Phonetics:
     """
@@ -52,18 +77,48 @@ class Phonetics:
         return syllables
 
     @staticmethod
-    def get_word_accent(word, accents_dict=AccentDict(os.path.join(settings.BASE_DIR, "static", "dicts", "accents_dict"))):
+    def get_word_accent(word, accents_dict=None):
         """
         Определение ударения в слове по словарю. Возможно несколько вариантов ударения.
+        Найденные ударения запоминаются в кэше словаря (AccentDict.accent_cache).
+        :param word: слово для простановки ударений
+        :param accents_dict: экземпляр обёртки для словаря ударений, по умолчанию общий словарь
+        :return accents: массив позиций букв, на которые падает ударение
+        """
+        if accents_dict is None:
+            accents_dict = get_default_accents_dict()
+        accents = accents_dict.accent_cache.get(word)
+        if accents is None:
+            accents = tuple(Phonetics.find_word_accent(word, accents_dict))
+            accents_dict.accent_cache.put(word, accents)
+        return list(accents)
+
+    @staticmethod
+    def get_accents_batch(words, accents_dict=None):
+        """
+        Определение ударений для набора слов, каждое слово разбирается один раз.
+        :param words: слова, возможно с повторами
+        :param accents_dict: экземпляр обёртки для словаря ударений, по умолчанию общий словарь
+        :return accents: словарь слово -> массив позиций ударений
+        """
+        if accents_dict is None:
+            accents_dict = get_default_accents_dict()
+        return {word: Phonetics.get_word_accent(word, accents_dict) for word in dict.fromkeys(words)}
+
+    @staticmethod
+    def find_word_accent(word, accents_dict):
+        """
+        Поиск ударения в слове по словарю, без кэша.
         :param word: слово для простановки ударений
         :param accents_dict: экземпляр обёртки для словаря ударений
         :return accents: массив позиций букв, на которые падает ударение
         """
         accents = []
-        if count_vowels(word) == 0:
+        vowels = count_vowels(word)
+        if vowels == 0:
             # Если гласных нет, то и ударений нет.
             pass
-        elif count_vowels(word) == 1:
+        elif vowels == 1:
             # Если одна гласная, то на неё и падает ударение.
             accents.append(get_first_vowel_position(word))
         elif word.find("ё") != -1:
@@ -73,22 +128,11 @@ class Phonetics:
             # Проверяем словарь на наличие форм с ударениями.
             accents = accents_dict.get_accents(word)
             if 'е' in word:
-                # Находим все возможные варинаты преобразований 'е' в 'ё'.
-                positions = [i for i in range(len(word)) if word[i] == 'е']
-                beam = [word[:positions[0]]]
-                for i in range(len(positions)):
-                    new_beam = []
-                    for prefix in beam:
-                        n = positions[i+1] if i+1 < len(positions) else len(word)
-                        new_beam.append(prefix + 'ё' + word[positions[i]+1:n])
-                        new_beam.append(prefix + 'е' + word[positions[i]+1:n])
-                        beam = new_beam
-                # И проверяем их по словарю.
-                for permutation in beam:
-                    if len(accents_dict.get_accents(permutation)) != 0:
-                        yo_pos = permutation.find("ё")
-                        if yo_pos != -1:
-                            accents.append(yo_pos)
+                # Находим в словаре все формы, где 'е' может быть 'ё', за один обход дерева.
+                for form, form_accents in accents_dict.get_yo_forms(word):
+                    yo_pos = form.find("ё")
+                    if yo_pos != -1:
+                        accents.append(yo_pos)
         return accents
 
     @staticmethod
@@ -1,9 +1,9 @@
 from collections import defaultdict
-from os import listdir
-from os.path import isfile, join
 
 from django.conf import settings
 
+from perashki.corpus import list_corpus_files, read_lines
+
 def make_pair(word1, word2):
     return '{} {}'.format(word1, word2)
 
@@ -24,7 +24,7 @@ class CollocationCounter:
     def __init__(self, pos_pair_list=[('NOUN', 'NOUN')], perashki_dir=settings.PERASHKI_TAGGED_DIR):
         self.good_pos_combinations = set(pos_pair_list)
         self.perashki_dir = perashki_dir
-        self.perashki_files = [join(perashki_dir, f) for f in listdir(perashki_dir) if isfile(join(perashki_dir, f))]
+        self.perashki_files = list_corpus_files(perashki_dir)
 
     def if_legal_pair_pos(self, word1, word2):
         pair_pos = (get_pos(word1), get_pos(word2))
@@ -43,16 +43,15 @@ class CollocationCounter:
         pairs = set()
 
         for perashok_file in self.perashki_files:
-            with open(perashok_file, encoding='utf-8') as input_stream:
-                for line in input_stream.readlines():
-                    words = line.split()
-                    for w in words:
-                        self.tokens_count[get_lemma(w)] += 1
-                    for i in range(len(words) - 1):
-                        if self.if_legal_pair_pos(words[i], words[i + 1]):
-                            pair = make_pair(words[i], words[i + 1])
-                            self.pairs_count[pair] += 1
-                            pairs.add(pair)
+            for line in read_lines(perashok_file):
+                words = line.split()
+                for w in words:
+                    self.tokens_count[get_lemma(w)] += 1
+                for i in range(len(words) - 1):
+                    if self.if_legal_pair_pos(words[i], words[i + 1]):
+                        pair = make_pair(words[i], words[i + 1])
+                        self.pairs_count[pair] += 1
+                        pairs.add(pair)
         measures = []
         for pair in pairs:
             measures.append((-measure_function(self, *pair.split()), pair))
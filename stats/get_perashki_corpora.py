@@ -15,6 +15,12 @@ import logging
 
 from django.conf import settings
 
+from perashki.corpus import read_lines
+from perashki.resources import lazy_resource
+
+# the analyzer loads its dictionaries once per process, on first use
+morph_analyzer = lazy_resource('morph_analyzer', pymorphy2.MorphAnalyzer)
+
 def get_corpus_from_web(perashki_dir=settings.PERASHKI_UNTAGGED_DIR):    
     def get_int(container):
         string = html.tostring(container, method="text", encoding='unicode').strip()
@@ -82,11 +88,12 @@ def get_lemma(word, morph_parser):
 
 def make_tagged_corpus(perashki_dir=settings.PERASHKI_UNTAGGED_DIR, perashki_tagged_dir=settings.PERASHKI_TAGGED_DIR):
     perashki = [(join(perashki_dir, f), join(perashki_tagged_dir, f)) for f in listdir(perashki_dir) if isfile(join(perashki_dir, f))]
-    morph = pymorphy2.MorphAnalyzer()
+    morph = morph_analyzer.get()
     
     for perashok_file, perashok_tagged_file in perashki:
-        with open(perashok_file, encoding='utf-8') as input_stream, open(perashok_tagged_file, 'w', encoding='utf-8') as output_stream:
-            for line in input_stream.readlines()[2:-1]:
+        with open(perashok_tagged_file, 'w', encoding='utf-8') as output_stream:
+            # the first two lines and the last one of a scraped file are not the poem
+            for line in read_lines(perashok_file, skip_head=2, skip_tail=1):
                 words = line.split()
                 words_tagged = []
                 for word in words: